@@ -0,0 +1,69 @@
+import numpy as np
+import scipy.special
+
+'''
+Helpers for the sampling engines (mi_computing_2, error_computing_1).
+
+With a tolerance (experiment.tolerance_for_mi / tolerance_for_error) the
+engines sample adaptively: they check the half width of the confidence
+interval of their estimate after initial_draws draws and then every time
+the number of draws has doubled, and stop once it is within the
+tolerance. The repetitions of the experiment are then the maximal number
+of draws. Without a tolerance exactly the repetitions are drawn.
+
+The intervals cover the sampling variance of the estimates only, not the
+bias of the plug-in MI estimate, which shrinks with the draws too.
+
+Engines setting records_sampling = True take a sampling argument (a
+CustomObj) and record into it the draws used and the achieved half width
+as 'draws' and 'ci_halfwidth'; the pipeline stores both with the job
+result. Analytic engines take no such argument.
+'''
+
+# Level of the confidence intervals.
+confidence_level = 0.95
+
+# Draws before the first check of convergence.
+initial_draws = 2**12
+
+'''
+Returns z such that the interval estimate +- z * standard error has
+confidence_level.
+'''
+def confidence_z():
+	return np.sqrt( 2.0 ) * scipy.special.erfinv( confidence_level )
+
+'''
+Returns the number of draws after which convergence is checked next,
+given draws done so far. Without a tolerance it is max_draws.
+'''
+def next_check( draws, max_draws, tolerance ):
+	if tolerance is None:
+		return max_draws
+	return min( max( initial_draws, 2 * draws ), max_draws )
+
+'''
+Raises ValueError unless the repetitions (the maximal number of draws) 
+of the engine are a positive number.
+'''
+def check_repetitions( repetitions, name ):
+	if repetitions is None or repetitions < 1:
+		raise ValueError( '{name} must be a positive number of draws, not '
+			'{repetitions}'.format( name = name, repetitions = repetitions ) )
+
+'''
+Returns pairs (first draw, size) of the batches which take draws to 
+target_draws.
+'''
+def batches( draws, target_draws, batch_size ):
+	return [ ( batch_begin, min( batch_size, target_draws - batch_begin ) )
+		for batch_begin in xrange( draws, target_draws, batch_size ) ]
+
+'''
+Records the draws used and the achieved confidence half width of an
+engine into sampling, if given.
+'''
+def record( sampling, draws, ci_halfwidth ):
+	if sampling is not None:
+		sampling.draws = int( draws )
+		sampling.ci_halfwidth = float( ci_halfwidth )
@@ -0,0 +1,88 @@
+import numpy as np
+import scipy.sparse
+import noise_models
+
+'''
+Helpers for the approximation sets used by the vectorized engines.
+The approx set around solution x is the gamma-window 
+	[ max( x - gamma, 0 ), min( x + gamma + 1, number_solutions ) ).
+'''
+
+'''
+Returns (begin, end) arrays of the approx sets around every solution.
+'''
+def approx_set_bounds( gamma, number_solutions ):
+	x = np.arange( number_solutions )
+	begin = np.maximum( x - gamma, 0 )
+	end = np.minimum( x + gamma + 1, number_solutions )
+	return begin, end
+
+'''
+Returns 1/len of the approx set around every solution.
+'''
+def approx_set_weights( gamma, number_solutions ):
+	begin, end = approx_set_bounds( gamma, number_solutions )
+	return 1.0 / ( end - begin )
+
+'''
+Returns cumulative sums of a along axis 0, with a leading row of zeros.
+They do not depend on gamma, hence can be shared between all gammas.
+'''
+def prefix_sums( a ):
+	cumulative = np.zeros( ( a.shape[0] + 1, ) + a.shape[1:] )
+	np.cumsum( a, axis = 0, out = cumulative[1:] )
+	return cumulative
+
+'''
+Window sums (see window_sums) looked up in precomputed prefix_sums.
+'''
+def window_sums_from_prefix( cumulative, gamma ):
+	begin, end = approx_set_bounds( gamma, cumulative.shape[0] - 1 )
+	return cumulative[ end ] - cumulative[ begin ]
+
+'''
+Sums a along axis 0 over the gamma-window of every row, i.e.
+result[i] = sum( a[ begin[i]:end[i] ] ). Done with cumulative sums, 
+hence O(a.size) independently of gamma.
+'''
+def window_sums( a, gamma ):
+	return window_sums_from_prefix( prefix_sums( a ), gamma )
+
+# p_joint is computed and stored as a sparse band matrix if its band 
+#  covers at most this fraction of the columns.
+sparse_band_fraction = 0.1
+
+'''
+Returns half_bandwidth if a band matrix with entries only within 
+half_bandwidth of the diagonal is worth storing sparsely, otherwise None.
+'''
+def sparse_bandwidth( half_bandwidth, number_solutions ):
+	if 2 * half_bandwidth + 1 <= sparse_band_fraction * number_solutions:
+		return half_bandwidth
+	return None
+
+'''
+Returns the half bandwidth of the sparse p_joint of the pairwise MI engines
+(mi_computing_3_vec, mi_computing_2) for gamma, or None if p_joint is 
+computed dense: the windows widen the band of the pair kernel, of half 
+bandwidth 2 * kernel bandwidth, by gamma on either side.
+'''
+def p_joint_bandwidth( gamma, experiment ):
+	bandwidth = noise_models.kernel_bandwidth( experiment.noise_model, 
+		experiment.number_solutions )
+	return sparse_bandwidth( 2 * ( bandwidth + gamma ), 
+		experiment.number_solutions )
+
+'''
+Returns the sparse (CSR) matrix W * diag( w ) with W[i, x] = 1 for x in the 
+gamma-window around i and w[x] = 1/len( approx_set( x ) ). Multiplying by 
+it does the weighted window sums of the engines in O(nonzeros).
+'''
+def window_matrix( gamma, number_solutions ):
+	begin, end = approx_set_bounds( gamma, number_solutions )
+	lengths = end - begin
+	indptr = np.concatenate( ( [ 0 ], np.cumsum( lengths ) ) )
+	indices = np.arange( indptr[-1] ) - np.repeat( indptr[:-1] - begin, lengths )
+	weights = approx_set_weights( gamma, number_solutions )
+	return scipy.sparse.csr_matrix( ( weights[ indices ], indices, indptr ), 
+		shape = ( number_solutions, number_solutions ) )
@@ -0,0 +1,320 @@
+import argparse as ap
+import os
+import sys
+import json
+import time
+import platform
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import scipy
+
+from common_defs import *
+import noise_models
+import engines
+import validate_engines
+
+"""
+Benchmarks of the engines, the sampler and the job pipeline.
+
+USAGE:
+    python benchmark.py [--quick] [--output FILE] [--baseline FILE]
+        [--save_baseline] [--engines NAME ...] [--number_solutions N ...]
+        [--gammas G ...] [--noise_models MODEL ...]
+
+Times every engine of engines.mi_computing_modules and
+engines.error_computing_modules over the grid of number_solutions x gamma
+x noise model (the slow engines only up to validate_engines.max_solutions),
+noise_models.generate_pairs / generate_pair, and the dispatch -> onejob
+-> finalize pipeline of run_simple-model_mut-inf_cluster.py, run as on
+the cluster (one process per job), and the startup of its processes.
+Engines are timed with cold caches, i.e. including the noise kernel, the
+best of --repeats runs.
+
+Writes the results as JSON into benchmarks/ (or --output), and compares
+them with the baseline (benchmarks/baseline.json, or --baseline): cases
+slower by more than --regression_tolerance and --min_slowdown are
+reported as regressions and make the exit status 1. --save_baseline
+stores the results as the new baseline.
+"""
+
+benchmark_filename = 'benchmark'
+baseline_filename = 'baseline'
+
+pipeline_script = 'run_simple-model_mut-inf_cluster.py'
+
+# Fields identifying a case, i.e. everything but the timing.
+case_fields = [ 'kind', 'name', 'noise_model', 'number_solutions', 'gamma' ]
+
+# In-memory caches of the engines, as (engine, cache attribute).
+engine_caches = [
+    ( 'mi_computing_1_vec', '_kernel_prefix_cache' ),
+    ( 'error_computing_2', '_distances_prefix_cache' ),
+]
+
+'''
+Clears the in-memory caches of noise models and engines, so that the next 
+engine call is timed cold.
+'''
+def clear_caches():
+    noise_models._model_cache.clear()
+    for engine, cache in engine_caches:
+        if engine in engines.mi_computing_modules:
+            module = engines.mi_computing_module( engine )
+        else:
+            module = engines.error_computing_module( engine )
+        getattr( module, cache ).clear()
+
+'''
+Returns the best of repeats wall times of function().
+'''
+def best_time( function, repeats, cold = True ):
+    times = []
+    for repeat in range( repeats ):
+        if cold:
+            clear_caches()
+        start_time = time.time()
+        function()
+        times.append( time.time() - start_time )
+    return min( times )
+
+def benchmark_engines( args ):
+    results = []
+    computed = [ ( 'mi', name,
+        engines.mi_computing_module( name ).compute_mutual_inf )
+        for name in sorted( engines.mi_computing_modules ) ]
+    computed += [ ( 'error', name,
+        engines.error_computing_module( name ).compute_error )
+        for name in sorted( engines.error_computing_modules ) ]
+
+    for kind, name, compute in computed:
+        if args.engines and name not in args.engines:
+            continue
+        for number_solutions in args.number_solutions:
+            if number_solutions > validate_engines.max_solutions.get( name, 
+                    number_solutions ):
+                continue
+            for noise_model in args.noise_models:
+                experiment = validate_engines.validation_experiment( 
+                    number_solutions, noise_model, args )
+                for gamma in args.gammas:
+                    seconds = best_time( lambda: compute( gamma, experiment ),
+                        args.repeats )
+                    results.append( dict( kind = kind, name = name,
+                        noise_model = noise_model, number_solutions = number_solutions,
+                        gamma = gamma, seconds = seconds ) )
+                    report( results[-1] )
+
+    return results
+
+def benchmark_sampler( args ):
+    results = []
+    for number_solutions in args.number_solutions:
+        for noise_model in args.noise_models:
+            rng = np.random.RandomState( args.seed )
+            # Warm, so that only the sampling itself is timed.
+            noise_models.generate_pairs( 1, number_solutions, noise_model, rng )
+            seconds = best_time( lambda: noise_models.generate_pairs(
+                args.repetitions, number_solutions, noise_model, rng ),
+                args.repeats, cold = False )
+            results.append( dict( kind = 'sampler', name = 'generate_pairs',
+                noise_model = noise_model, number_solutions = number_solutions,
+                gamma = None, draws = args.repetitions, seconds = seconds ) )
+            report( results[-1] )
+
+            calls = 1000
+            seconds = best_time( lambda: [ noise_models.generate_pair(
+                number_solutions, noise_model ) for call in range( calls ) ],
+                args.repeats, cold = False )
+            results.append( dict( kind = 'sampler', name = 'generate_pair',
+                noise_model = noise_model, number_solutions = number_solutions,
+                gamma = None, draws = calls, seconds = seconds ) )
+            report( results[-1] )
+
+    return results
+
+'''
+Runs the pipeline of the cluster on a small experiment: --dispatch with
+the dry-run scheduler, every --onejob in its own process, --finalize.
+The experiment is removed afterwards.
+'''
+def benchmark_pipeline( args ):
+    script_dir_name = os.path.dirname( os.path.abspath( __file__ ) )
+    script = os.path.join( script_dir_name, pipeline_script )
+    name = 'benchmark_pipeline_{pid}'.format( pid = os.getpid() )
+    number_solutions = args.number_solutions[0]
+    noise_model = args.noise_models[0]
+    jobs = len( args.gammas )
+    # A fresh kernel cache, so that kernels cached by earlier runs in 
+    #  data/kernels are not read.
+    kernel_cache_dir = tempfile.mkdtemp()
+
+    def run( *arguments ):
+        with open( os.devnull, 'w' ) as devnull:
+            subprocess.check_call( [ sys.executable, script, '--name', name,
+                '--kernel_cache_dir', kernel_cache_dir ] + list( arguments ), 
+                stdout = devnull, stderr = devnull, cwd = script_dir_name )
+
+    results = []
+    def record( phase, seconds ):
+        results.append( dict( kind = 'pipeline', name = phase,
+            noise_model = noise_model, number_solutions = number_solutions,
+            gamma = None, jobs = jobs, seconds = seconds ) )
+        report( results[-1] )
+
+    # Startup of the script, i.e. interpreter and imports of a worker.
+    seconds = best_time( lambda: run( '--help' ), args.repeats, cold = False )
+    record( 'startup', seconds )
+
+    gamma_step = max( 1, args.gammas[1] - args.gammas[0] ) if jobs > 1 else 1
+    try:
+        start_time = time.time()
+        run( '--dispatch', '--scheduler', 'dry-run',
+            '--number_solutions', str( number_solutions ),
+            '--noise_model', noise_model,
+            '--mi_computing_type', args.pipeline_mi_computing_type,
+            '--error_computing_type', args.pipeline_error_computing_type,
+            '--gamma_val_low', str( args.gammas[0] ),
+            '--gamma_val_high', str( args.gammas[0] + jobs * gamma_step ),
+            '--gamma_val_step', str( gamma_step ),
+            '--repetitions_for_error', str( args.repetitions ),
+            '--repetitions_for_mi', str( args.repetitions ), 
+            '--seed', str( args.seed ) )
+        record( 'dispatch', time.time() - start_time )
+
+        start_time = time.time()
+        for k in range( jobs ):
+            run( '--onejob', '--jobnumber', str( k ) )
+        record( 'onejob', time.time() - start_time )
+
+        start_time = time.time()
+        run( '--finalize' )
+        record( 'finalize', time.time() - start_time )
+    finally:
+        shutil.rmtree( os.path.join( script_dir_name, experiments_folder_name,
+            name ), ignore_errors = True )
+        shutil.rmtree( kernel_cache_dir, ignore_errors = True )
+
+    return results
+
+def report( result ):
+    print( '{kind:8} {name:20} {noise_model:26} N={number_solutions:<6} '
+        'gamma={gamma!s:5} {seconds:10.4f} s'.format( **result ) )
+
+def case_key( result ):
+    return tuple( result.get( field ) for field in case_fields )
+
+'''
+Compares results with the baseline ones. Returns the list of regressions,
+i.e. of cases slower by more than regression_tolerance (relative) and
+min_slowdown seconds, the latter to ignore the jitter of fast cases.
+'''
+def compare_with_baseline( results, baseline, regression_tolerance,
+        min_slowdown ):
+    baseline_times = dict( ( case_key( result ), result[ 'seconds' ] )
+        for result in baseline[ 'results' ] )
+
+    regressions = []
+    print( '\nComparison with the baseline of {time}:'.format(
+        time = baseline[ 'meta' ][ 'time' ] ) )
+    for result in results:
+        key = case_key( result )
+        if key not in baseline_times:
+            continue
+        ratio = result[ 'seconds' ] / max( baseline_times[ key ], 1e-9 )
+        slowdown = result[ 'seconds' ] - baseline_times[ key ]
+        if ratio > 1 + regression_tolerance and slowdown > min_slowdown:
+            verdict = 'REGRESSION'
+            regressions.append( result )
+        elif ratio < 1 / ( 1 + regression_tolerance ):
+            verdict = 'improved'
+        else:
+            verdict = ''
+        print( '{key:90} {ratio:7.2f}x {verdict}'.format(
+            key = ' '.join( str( field ) for field in key ), ratio = ratio,
+            verdict = verdict ) )
+
+    return regressions
+
+def environment():
+    return dict( time = time.strftime( '%Y-%m-%d %H:%M:%S' ),
+        host = platform.node(), python = platform.python_version(),
+        numpy = np.__version__, scipy = scipy.__version__ )
+
+if __name__ == "__main__":
+
+    parser = ap.ArgumentParser( description='Benchmarks of engines, sampler '
+        'and pipeline' )
+    parser.add_argument('--quick', action='store_true', help='Small grid only')
+    parser.add_argument('--number_solutions', action='store', type=int, nargs='+',
+        default=[ 100, 1000 ], help='Grid of number_solutions')
+    parser.add_argument('--gammas', action='store', type=int, nargs='+',
+        default=[ 0, 10 ], help='Grid of gammas')
+    parser.add_argument('--noise_models', action='store', nargs='+',
+        default=[ 'trunc-gauss_2', 'trunc-gauss_50', 'one-peaked-running-debug' ],
+        help='Grid of noise models')
+    parser.add_argument('--engines', action='store', nargs='+',
+        help='Benchmark only these engines')
+    parser.add_argument('--repetitions', action='store', type=int, default=10**5,
+        help='Draws of the sampling engines and the sampler')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+        help='Seed of the sampling engines and the sampler')
+    parser.add_argument('--repeats', action='store', type=int, default=3,
+        help='Timings per case, the best one is reported')
+    parser.add_argument('--pipeline_mi_computing_type', action='store',
+        default='mi_computing_3_vec', help='mi engine of the pipeline benchmark')
+    parser.add_argument('--pipeline_error_computing_type', action='store',
+        default='error_computing_2', help='error engine of the pipeline benchmark')
+    parser.add_argument('--skip_pipeline', action='store_true',
+        help='Do not benchmark the pipeline')
+    parser.add_argument('--output', action='store', help='Results file, '
+        'benchmarks/benchmark_<time>.json by default')
+    parser.add_argument('--baseline', action='store', help='Baseline file, '
+        'benchmarks/baseline.json by default')
+    parser.add_argument('--save_baseline', action='store_true',
+        help='Store the results as the baseline')
+    parser.add_argument('--regression_tolerance', action='store', type=float,
+        default=0.25, help='Relative slowdown reported as regression')
+    parser.add_argument('--min_slowdown', action='store', type=float,
+        default=0.01, help='Slowdown in seconds below which no regression '
+        'is reported')
+
+    args = parser.parse_args()
+    if args.quick:
+        args.number_solutions = [ 50 ]
+        args.gammas = [ 0, 5 ]
+        args.noise_models = [ 'trunc-gauss_2' ]
+        args.repetitions = 10**4
+        args.repeats = 1
+
+    dir_name = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+        benchmarks_folder_name )
+    if not os.path.exists( dir_name ):
+        os.mkdir( dir_name )
+
+    results = benchmark_engines( args ) + benchmark_sampler( args )
+    if not args.skip_pipeline:
+        results += benchmark_pipeline( args )
+
+    benchmark = dict( meta = environment(), results = results )
+    output_filename = args.output or os.path.join( dir_name, benchmark_filename
+        + '_' + time.strftime( '%Y%m%d-%H%M%S' ) + os.extsep + json_suffix )
+    with open( output_filename, 'w' ) as output:
+        json.dump( benchmark, output, indent = 1, sort_keys = True )
+    print( 'Results written to ' + output_filename )
+
+    baseline_filename = args.baseline or os.path.join( dir_name,
+        baseline_filename + os.extsep + json_suffix )
+    regressions = []
+    if os.path.exists( baseline_filename ) and not args.save_baseline:
+        with open( baseline_filename, 'r' ) as input:
+            regressions = compare_with_baseline( results, json.load( input ),
+                args.regression_tolerance, args.min_slowdown )
+    if args.save_baseline:
+        shutil.copyfile( output_filename, baseline_filename )
+        print( 'Baseline saved to ' + baseline_filename )
+
+    if regressions:
+        print( '{count} regressions'.format( count = len( regressions ) ) )
+        sys.exit( 1 )
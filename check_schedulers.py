@@ -0,0 +1,146 @@
+import argparse as ap
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from common_defs import *
+import job_manifest
+import result_store
+
+"""
+Check of the LSF and Slurm backends of job_schedulers against the fake
+bsub and sbatch of scheduler_stubs/.
+
+USAGE:
+    python check_schedulers.py [--backends lsf slurm] [--jobs J]
+
+For every backend dispatches a small experiment with --scheduler, the
+stubs on PATH running its array tasks one after another, and checks the
+array specification of the job script, the job id reported on
+submission, the manifest and job result of every job, and that
+--finalize merges all of them. The stubs run the tasks with 'python' as
+the job script does, which is made this interpreter here. The
+experiments are removed afterwards.
+
+Exits with status 1 if any check fails.
+"""
+
+pipeline_script = 'run_simple-model_mut-inf_cluster.py'
+stubs_folder_name = 'scheduler_stubs'
+
+# Per backend: the array line of its job script, with the array indices
+#  of the first and last job, the index of the first job and the job id
+#  the stub reports.
+backends = {
+    'lsf': ( '#BSUB -J "{name}[{first}-{last}]"', 1, '4242' ),
+    'slurm': ( '#SBATCH --array={first}-{last}', 0, '4343' ),
+}
+
+'''
+Returns the environment of the pipeline: the stubs and a 'python' running
+this interpreter first on PATH.
+'''
+def stub_environment( python_dir_name, script_dir_name, job_id ):
+    environment = dict( os.environ )
+    environment[ 'PATH' ] = os.pathsep.join( [ os.path.join( script_dir_name,
+        stubs_folder_name ), python_dir_name, environment.get( 'PATH', '' ) ] )
+    environment[ 'STUB_JOB_ID' ] = job_id
+    return environment
+
+'''
+Runs the pipeline script, returns (exit status, output).
+'''
+def run( script_dir_name, environment, name, *arguments ):
+    process = subprocess.Popen( [ sys.executable, os.path.join( script_dir_name,
+        pipeline_script ), '--name', name ] + list( arguments ),
+        stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+        cwd = script_dir_name, env = environment )
+    output = process.communicate()[0].decode( 'utf-8', 'replace' )
+    return process.returncode, output
+
+'''
+Dispatches the experiment with the backend and checks it, see the module
+docstring. Returns the list of (check, passed).
+'''
+def check_backend( backend, python_dir_name, script_dir_name, args ):
+    array_line, first_index, job_id = backends[ backend ]
+    name = 'check_schedulers_{backend}_{pid}'.format( backend = backend,
+        pid = os.getpid() )
+    dir_name = os.path.join( script_dir_name, experiments_folder_name, name )
+    environment = stub_environment( python_dir_name, script_dir_name, job_id )
+
+    checks = []
+    try:
+        status, output = run( script_dir_name, environment, name, '--dispatch',
+            '--scheduler', backend, '--number_solutions', '30',
+            '--noise_model', 'trunc-gauss_2',
+            '--mi_computing_type', 'mi_computing_3_vec',
+            '--error_computing_type', 'error_computing_2',
+            '--gamma_val_low', '0', '--gamma_val_high', str( args.jobs ),
+            '--gamma_val_step', '1' )
+        checks.append( ( 'dispatch exits with 0', status == 0 ) )
+        if status != 0:
+            print( output )
+            return checks
+
+        script_filename = os.path.join( dir_name, name + '_' + backend
+            + os.extsep + 'sh' )
+        with open( script_filename, 'r' ) as input:
+            script_lines = input.read().splitlines()
+        expected_line = array_line.format( name = name, first = first_index,
+            last = first_index + args.jobs - 1 )
+        checks.append( ( 'job script has ' + expected_line,
+            expected_line in script_lines ) )
+        checks.append( ( 'job id {job_id} reported'.format( job_id = job_id ),
+            'Submitted job array {job_id} '.format( job_id = job_id ) in output ) )
+
+        manifest = job_manifest.load_manifest( dir_name, name )
+        for k in range( args.jobs ):
+            job = manifest[ 'jobs' ].get( str( k ), {} )
+            checks.append( ( 'job {k} done with its job result'.format( k = k ),
+                job.get( 'status' ) == job_manifest.status_done
+                and job.get( 'scheduler' ) == backend
+                and os.path.exists( result_store.jobresult_filename( dir_name,
+                name, k ) ) ) )
+
+        status, output = run( script_dir_name, environment, name, '--finalize' )
+        checks.append( ( 'finalize merges all jobs', status == 0
+            and '{jobs}/{jobs} merged'.format( jobs = args.jobs ) in output ) )
+    finally:
+        shutil.rmtree( dir_name, ignore_errors = True )
+
+    return checks
+
+if __name__ == "__main__":
+
+    parser = ap.ArgumentParser( description='Check of the scheduler backends '
+        'against fake bsub and sbatch' )
+    parser.add_argument('--backends', action='store', nargs='+',
+        default=sorted( backends ), choices=sorted( backends ),
+        help='Backends to check')
+    parser.add_argument('--jobs', action='store', type=int, default=3,
+        help='Number of jobs of the dispatched experiment')
+
+    args = parser.parse_args()
+
+    script_dir_name = os.path.dirname( os.path.abspath( __file__ ) )
+    python_dir_name = tempfile.mkdtemp()
+    os.symlink( sys.executable, os.path.join( python_dir_name, 'python' ) )
+
+    failures = 0
+    try:
+        for backend in args.backends:
+            for check, passed in check_backend( backend, python_dir_name,
+                    script_dir_name, args ):
+                print( '{verdict:4} {backend:6} {check}'.format(
+                    verdict = 'ok' if passed else 'FAIL', backend = backend,
+                    check = check ) )
+                failures += not passed
+    finally:
+        shutil.rmtree( python_dir_name )
+
+    print( '{failures} checks failed'.format( failures = failures ) )
+    if failures:
+        sys.exit( 1 )
@@ -8,8 +8,17 @@ class CustomObj: pass
 # Suffix for files.
 experiments_folder_name = 'data'
 figures_folder_name = 'figures'
+kernel_cache_folder_name = 'kernels'
+benchmarks_folder_name = 'benchmarks'
 experiment_setting_filename = 'setting'
 experiment_jobresult_filename = 'jobresult'
+experiment_jobcache_filename = 'jobcache'
+experiment_manifest_filename = 'manifest'
 experiment_finalresult_filename = 'final'
+experiment_cprofile_filename = 'cprofile'
 
 pickle_suffix = 'pk'
+numpy_array_suffix = 'npy'
+numpy_archive_suffix = 'npz'
+json_suffix = 'json'
+cprofile_suffix = 'prof'
@@ -0,0 +1,36 @@
+import importlib
+
+'''
+Registries of the engines, selected by --mi_computing_type and
+--error_computing_type of the experiment: names of the engine modules,
+imported only when an engine is used (see mi_computing_module and
+error_computing_module), so that a job imports its own engines only.
+'''
+
+mi_computing_modules = {
+    "mi_computing_1": "mi_computing_1",
+    "mi_computing_2": "mi_computing_2",
+    "mi_computing_3": "mi_computing_3",
+    "mi_computing_4": "mi_computing_4",
+    "mi_computing_1_vec": "mi_computing_1_vec",
+    "mi_computing_3_vec": "mi_computing_3_vec",
+    "mi_computing_4_vec": "mi_computing_4_vec",
+}
+
+error_computing_modules = {
+    "error_computing_1": "error_computing_1",
+    "error_computing_2": "error_computing_2",
+}
+
+'''
+Returns the module of the mi engine, importing it on first use.
+'''
+def mi_computing_module( mi_computing_type ):
+    return importlib.import_module( mi_computing_modules[ mi_computing_type ] )
+
+'''
+Returns the module of the error engine, importing it on first use.
+'''
+def error_computing_module( error_computing_type ):
+    return importlib.import_module(
+        error_computing_modules[ error_computing_type ] )
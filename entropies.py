@@ -0,0 +1,89 @@
+import numpy as np
+import scipy.sparse
+import scipy.special
+
+from common_defs import *
+
+'''
+Reduction of a joint distribution p_joint[i, j] to mutual information and
+entropies (in bits), shared by the mi engines.
+
+Entries with | p | <= zero_tolerance are treated as zeros, which is the
+np.allclose( p, 0 ) of the loop versions, so that all engines agree with
+them; with zero_tolerance = 0 this is plain x log x with 0 log 0 = 0. The
+marginal entropies are summed over the same entries:
+	h_rows = - sum_{i, j} p_joint[i, j] log p_rows[i]
+(over i with p_rows[i] nonzero), which is the h_single of the engines and
+equals the entropy of p_rows if it is the marginal of p_joint.
+'''
+
+# Same as np.allclose( p, 0 ).
+default_zero_tolerance = 1e-8
+
+# Maximal number of entries of a dense p_joint reduced at once.
+max_block_size = 2**22
+
+'''
+Returns the sums ( mutual_inf, h_joint, h_rows, h_cols ) over the given
+nonzero entries p_nonzero = p_joint[ rows, cols ] only. The terms of
+several blocks of entries add up.
+'''
+def entropy_sums( p_nonzero, rows, cols, p_rows, p_cols,
+		zero_tolerance = default_zero_tolerance ):
+	p_nonzero_rows = p_rows[ rows ]
+	p_nonzero_cols = p_cols[ cols ]
+
+	mutual_inf = np.sum( scipy.special.xlogy( p_nonzero,
+		p_nonzero / ( p_nonzero_rows * p_nonzero_cols ) ) )
+	h_joint = -np.sum( scipy.special.xlogy( p_nonzero, p_nonzero ) )
+
+	rows_nonzero = np.abs( p_nonzero_rows ) > zero_tolerance
+	h_rows = -np.sum( scipy.special.xlogy( p_nonzero[ rows_nonzero ],
+		p_nonzero_rows[ rows_nonzero ] ) )
+	cols_nonzero = np.abs( p_nonzero_cols ) > zero_tolerance
+	h_cols = -np.sum( scipy.special.xlogy( p_nonzero[ cols_nonzero ],
+		p_nonzero_cols[ cols_nonzero ] ) )
+
+	return np.array( [ mutual_inf, h_joint, h_rows, h_cols ] ) / np.log( 2 )
+
+'''
+Reduces p_joint (dense array or scipy.sparse matrix) in one pass. p_rows
+and p_cols default to the marginals of p_joint. dtype (e.g. np.float32)
+is the precision of the reduction, dense p_joint is reduced in blocks of
+rows of at most max_block_size entries. Returns a CustomObj with
+mutual_inf, h_joint, h_rows, h_cols, h_rows_given_cols and
+h_cols_given_rows.
+'''
+def joint_entropies( p_joint, p_rows = None, p_cols = None,
+		zero_tolerance = default_zero_tolerance, dtype = np.float64 ):
+	if p_rows is None:
+		p_rows = np.asarray( p_joint.sum( axis = 1 ) ).ravel()
+	if p_cols is None:
+		p_cols = np.asarray( p_joint.sum( axis = 0 ) ).ravel()
+	p_rows = np.asarray( p_rows, dtype = dtype )
+	p_cols = np.asarray( p_cols, dtype = dtype )
+
+	sums = np.zeros( 4 )
+	if scipy.sparse.issparse( p_joint ):
+		p_entries = p_joint.tocoo()
+		nonzero = np.abs( p_entries.data ) > zero_tolerance
+		sums += entropy_sums( p_entries.data[ nonzero ].astype( dtype ),
+			p_entries.row[ nonzero ], p_entries.col[ nonzero ], p_rows, p_cols,
+			zero_tolerance )
+	else:
+		block_rows = max( 1, max_block_size // max( p_joint.shape[1], 1 ) )
+		for block_begin in xrange( 0, p_joint.shape[0], block_rows ):
+			p_block = np.asarray( p_joint[ block_begin:block_begin + block_rows ],
+				dtype = dtype )
+			nonzero = np.abs( p_block ) > zero_tolerance
+			rows, cols = np.nonzero( nonzero )
+			sums += entropy_sums( p_block[ nonzero ], block_begin + rows, cols,
+				p_rows, p_cols, zero_tolerance )
+
+	reduction = CustomObj()
+	reduction.mutual_inf, reduction.h_joint, reduction.h_rows, \
+		reduction.h_cols = [ float( value ) for value in sums ]
+	reduction.h_rows_given_cols = reduction.h_joint - reduction.h_cols
+	reduction.h_cols_given_rows = reduction.h_joint - reduction.h_rows
+
+	return reduction
@@ -1,28 +1,68 @@
 import numpy as np
 import noise_models
+import adaptive_sampling
+import random_streams
+from approx_sets import approx_set_bounds
 
 '''
 Computing error by sampling
 '''
+
+# Number of samples drawn at once.
+batch_size = 2**20
+
+# Reports how many errors were drawn and how tight their mean is.
+records_sampling = True
 	
 '''
 Computes error. Returns average error and interval.
+With experiment.tolerance_for_error set, samples until the confidence 
+interval of the average error is within it (at most repetitions_for_error
+draws), see adaptive_sampling.
 '''
-def compute_error( gamma, experiment ):
+def compute_error( gamma, experiment, sampling = None ):
 	
 	number_solutions = experiment.number_solutions
 	noise_model = experiment.noise_model
 	repetitions_for_error = experiment.repetitions_for_error
+	tolerance = getattr( experiment, 'tolerance_for_error', None )
+	adaptive_sampling.check_repetitions( repetitions_for_error, 
+		'repetitions_for_error' )
+
+	begin, end = approx_set_bounds( gamma, number_solutions )
 
-	errors = np.zeros( repetitions_for_error )
+	# Running sums of errors and squared errors.
+	sum_errors = 0.0
+	sum_squared_errors = 0.0
 
-	for k in range( repetitions_for_error ):
-		# Generate pair x and respective approx set.
-		[x, foo, true_mu] = noise_models.generate_pair( number_solutions, noise_model )
-		approx_set = max( x - gamma, 0 ), min( x + gamma + 1, number_solutions )
-		errors[k] = abs( np.random.randint( approx_set[0], high = approx_set[1] ) 
-			- true_mu )
+	draws = 0
+	while draws < repetitions_for_error:
+		target_draws = adaptive_sampling.next_check( draws, repetitions_for_error, 
+			tolerance )
+		for batch_begin, curr_batch_size in adaptive_sampling.batches( draws, 
+				target_draws, batch_size ):
+			rng = random_streams.batch_stream( experiment, 'error_computing_1', gamma, 
+				batch_begin )
+		
+			# Generate x's and pick uniformly from the respective approx sets.
+			samples_x, foo, samples_mu = noise_models.generate_pairs( 
+				curr_batch_size, number_solutions, noise_model, rng )
+			lengths = end[ samples_x ] - begin[ samples_x ]
+			picks = begin[ samples_x ] + np.minimum( 
+				( rng.uniform( size = curr_batch_size ) * lengths ).astype( int ),
+				lengths - 1 )
+			
+			errors = np.abs( picks - samples_mu ).astype( float )
+			sum_errors += np.sum( errors )
+			sum_squared_errors += np.sum( errors**2 )
+		draws = target_draws
 
-	return np.mean( errors ), np.std( errors )
+		mean_err = sum_errors / draws
+		std_err = np.sqrt( max( sum_squared_errors / draws - mean_err**2, 0.0 ) )
+		ci_halfwidth = adaptive_sampling.confidence_z() * std_err / np.sqrt( draws )
+		if tolerance is not None and ci_halfwidth <= tolerance:
+			break
 
+	adaptive_sampling.record( sampling, draws, ci_halfwidth )
 
+	return mean_err, std_err
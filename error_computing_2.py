@@ -0,0 +1,47 @@
+import numpy as np
+import noise_models
+from approx_sets import approx_set_weights, prefix_sums, window_sums_from_prefix
+
+'''
+Computing error analytically, i.e. the exact values which error_computing_1
+estimates by sampling: x is generated from mu, the solution is picked 
+uniformly from the approx set of x, the error is | solution - mu |.
+'''
+	
+# Cache of prefix sums of distances and squared distances, keyed by 
+#  number_solutions. They do not depend on gamma, so a sweep over gammas 
+#  computes them once.
+_distances_prefix_cache = {}
+
+def _distances_prefix_sums( number_solutions ):
+	if number_solutions not in _distances_prefix_cache:
+		solutions = np.arange( number_solutions )
+		distances = np.abs( solutions[ :, np.newaxis ] 
+			- solutions[ np.newaxis, : ] ).astype( float )
+		_distances_prefix_cache[ number_solutions ] = ( prefix_sums( distances ), 
+			prefix_sums( distances**2 ) )
+
+	return _distances_prefix_cache[ number_solutions ]
+
+'''
+Computes error. Returns average error and standard deviation.
+'''
+def compute_error( gamma, experiment ):
+	
+	number_solutions = experiment.number_solutions
+	noise_model = experiment.noise_model
+	kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
+	distances_prefix, squared_distances_prefix = _distances_prefix_sums( 
+		number_solutions )
+
+	# p_x_mu[x, mu] = p(mu) * p(x | mu) / len( approx_set( x ) ), to be 
+	#  multiplied by sum of errors over the approx set of x.
+	weights = approx_set_weights( gamma, number_solutions )
+	p_x_mu = weights[ :, np.newaxis ] * kernel * prior
+
+	mean_err = np.sum( p_x_mu * window_sums_from_prefix( distances_prefix, gamma ) )
+	mean_squared_err = np.sum( p_x_mu 
+		* window_sums_from_prefix( squared_distances_prefix, gamma ) )
+	std_err = np.sqrt( max( mean_squared_err - mean_err**2, 0.0 ) )
+
+	return mean_err, std_err
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import fcntl
+
+from common_defs import *
+from result_store import jobresult_filename, file_checksum
+
+'''
+Completion manifest of an experiment: one JSON file in the experiment 
+folder with the status of every job, i.e.
+	{ "jobs": { "<jobnumber>": { "gamma": ..., "status": ..., ... } } }
+with status one of 'queued', 'running', 'done', 'failed'. Finished jobs 
+also record wall time and the checksum of their jobresult file, failed 
+ones the error.
+
+Jobs of an array may finish concurrently, hence every update is done 
+under an exclusive lock of a side lock file.
+'''
+
+status_queued = 'queued'
+status_running = 'running'
+status_done = 'done'
+status_failed = 'failed'
+
+def manifest_filename( dir_name, name ):
+    return os.path.join( dir_name, name + '_' + experiment_manifest_filename 
+        + os.extsep + json_suffix )
+
+def load_manifest( dir_name, name ):
+    filename = manifest_filename( dir_name, name )
+    if not os.path.exists( filename ):
+        return { 'jobs': {} }
+    with open( filename, 'r' ) as input:
+        return json.load( input )
+
+'''
+Updates the manifest entry of one job with the given fields, and sets 
+its 'updated' time.
+'''
+def update_job( dir_name, name, jobnumber, **fields ):
+    filename = manifest_filename( dir_name, name )
+    with open( filename + '.lock', 'w' ) as lock:
+        fcntl.flock( lock, fcntl.LOCK_EX )
+        manifest = load_manifest( dir_name, name )
+        job = manifest[ 'jobs' ].setdefault( str( jobnumber ), {} )
+        job.update( fields )
+        job[ 'updated' ] = time.time()
+
+        with open( filename + '.tmp', 'w' ) as output:
+            json.dump( manifest, output, indent = 1, sort_keys = True )
+        os.rename( filename + '.tmp', filename )
+
+'''
+Returns whether the job is done and its jobresult file is intact.
+'''
+def is_job_complete( dir_name, name, manifest, jobnumber ):
+    job = manifest[ 'jobs' ].get( str( jobnumber ) )
+    if job is None or job.get( 'status' ) != status_done:
+        return False
+    # Done by a sweep, straight into the final result.
+    if job.get( 'checksum' ) is None:
+        return True
+
+    filename = jobresult_filename( dir_name, name, jobnumber )
+    return ( os.path.exists( filename ) 
+        and file_checksum( filename ) == job.get( 'checksum' ) )
+
+'''
+Returns the checksums of the jobresult files of the done jobs, by 
+jobnumber. Only these are merged into the final result.
+'''
+def done_checksums( dir_name, name ):
+    manifest = load_manifest( dir_name, name )
+    return dict( ( int( k ), job.get( 'checksum' ) ) 
+        for k, job in manifest[ 'jobs' ].items() 
+        if job.get( 'status' ) == status_done )
+
+'''
+Returns the sorted jobnumbers which are missing, failed or whose 
+jobresult file does not match its checksum. Queued and running jobs may 
+still be alive in the scheduler, they are included only if 
+include_pending.
+'''
+def incomplete_jobs( dir_name, experiment, include_pending = False ):
+    manifest = load_manifest( dir_name, experiment.name )
+    pending = [] if include_pending else [ status_queued, status_running ]
+    return [ k for k in range( len( experiment.job_gammas ) ) 
+        if not is_job_complete( dir_name, experiment.name, manifest, k ) 
+        and manifest[ 'jobs' ].get( str( k ), {} ).get( 'status' ) not in pending ]
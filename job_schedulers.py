@@ -0,0 +1,217 @@
+import os
+import re
+import math
+from subprocess import Popen, PIPE
+
+from common_defs import *
+
+'''
+Scheduler backends for dispatching the --onejob jobs of an experiment as 
+one job array: LSF (bsub), Slurm (sbatch) and dry-run, which only writes 
+the job scripts. The local pool backend lives in the main script.
+
+Every backend is a function ( dir_name, args, experiment, jobnumbers ) 
+running or submitting the given jobs, and returning the list of failed 
+jobnumbers, if known at return (always empty for submitting
+backends, the jobs are still queued then).
+
+Array tasks do not get --jobnumber, they take it from the environment, 
+see array_jobnumber.
+'''
+
+run_script_filename = 'run_simple-model_mut-inf_cluster.py'
+
+# Rough rates of elementary operations per second: for engines looping in 
+#  Python and for vectorized numpy engines.
+python_ops_per_second = 1e6
+numpy_ops_per_second = 1e8
+
+# Safety factor on estimated run time and limits of the requests.
+time_safety_factor = 4.0
+min_time_minutes = 10
+max_time_minutes = 120 * 60
+base_memory_mb = 512
+
+'''
+Rough cost of one job, as (number of operations, operations per second, 
+bytes of memory). N is number_solutions, gamma is the largest gamma. 
+Engines computing p_joint sparse (experiment.p_joint_band set) work on 
+its N x ( 2 p_joint_band + 1 ) band only.
+'''
+def mi_job_cost( mi_computing_type, N, gamma, experiment ):
+    window = 2 * gamma + 1
+    band = getattr( experiment, 'p_joint_band', None )
+    if band is not None:
+        entries = N * ( 2 * band + 1 )
+        if mi_computing_type == 'mi_computing_2':
+            return ( experiment.repetitions_for_mi + entries, numpy_ops_per_second,
+                8 * 2**20 * 16 + 8 * 4 * entries )
+        return entries, numpy_ops_per_second, 8 * 10 * entries
+    if mi_computing_type == 'mi_computing_1':
+        return N**6, python_ops_per_second, 8 * N**2
+    if mi_computing_type == 'mi_computing_2':
+        return ( experiment.repetitions_for_mi + N**2, numpy_ops_per_second, 
+            8 * 2**20 * 16 + 8 * 4 * N**2 )
+    if mi_computing_type == 'mi_computing_3':
+        return N**2 * min( window, N )**2 * N, numpy_ops_per_second / 10, 8 * 4 * N**2
+    if mi_computing_type == 'mi_computing_4':
+        return N**2 * min( window, N ), python_ops_per_second, 8 * 4 * N**2
+    if mi_computing_type == 'mi_computing_1_vec':
+        # Products of the ~N^2 / 2 approx sets with each other over the N mu's.
+        return N**5 / 4, numpy_ops_per_second * 10, 8 * ( N**3 + 2**22 * 3 )
+    # Remaining vectorized engines are O(N^3) for the kernels and O(N^2) per gamma.
+    return N**3, numpy_ops_per_second * 10, 8 * 10 * N**2
+
+def error_job_cost( error_computing_type, N, gamma, experiment ):
+    if error_computing_type == 'error_computing_1':
+        return ( experiment.repetitions_for_error, numpy_ops_per_second / 10, 
+            8 * 2**20 * 10 )
+    return 4 * N**2, numpy_ops_per_second, 8 * 6 * N**2
+
+'''
+Estimates the resources to request for every job of the experiment, as 
+(minutes, memory in MB). All the jobs of an array share one request, 
+hence the estimate is for the largest gamma.
+'''
+def estimate_resources( experiment ):
+    N = experiment.number_solutions
+    gamma = max( experiment.job_gammas )
+
+    seconds = 0.0
+    memory = 0
+    for operations, rate, memory_bytes in [ 
+            mi_job_cost( experiment.mi_computing_type, N, gamma, experiment ),
+            error_job_cost( experiment.error_computing_type, N, gamma, experiment ) ]:
+        seconds += float( operations ) / rate
+        memory = max( memory, memory_bytes )
+
+    minutes = int( math.ceil( time_safety_factor * seconds / 60.0 ) )
+    minutes = min( max( minutes, min_time_minutes ), max_time_minutes )
+    memory_mb = base_memory_mb + int( math.ceil( 2.0 * memory / 2**20 ) )
+
+    return minutes, memory_mb
+
+'''
+Returns the jobnumber of the current array task from the environment of 
+the scheduler, None if not running as an array task.
+'''
+def array_jobnumber():
+    if 'SLURM_ARRAY_TASK_ID' in os.environ:
+        return int( os.environ[ 'SLURM_ARRAY_TASK_ID' ] )
+    if 'LSB_JOBINDEX' in os.environ:
+        # LSF array indices start from 1.
+        return int( os.environ[ 'LSB_JOBINDEX' ] ) - 1
+    return None
+
+'''
+Formats sorted indices as a scheduler array specification, e.g. 
+[0, 1, 2, 5] with offset 1 gives '1-3,6'.
+'''
+def array_indices( jobnumbers, offset ):
+    ranges = []
+    for k in sorted( jobnumbers ):
+        if ranges and ranges[-1][1] == k - 1:
+            ranges[-1][1] = k
+        else:
+            ranges.append( [ k, k ] )
+
+    return ','.join( str( begin + offset ) if begin == end 
+        else '{0}-{1}'.format( begin + offset, end + offset ) 
+        for begin, end in ranges )
+
+def onejob_command( args ):
+    command = 'python {script} --onejob --name {name}'.format( 
+        script = run_script_filename, name = args.name )
+    if getattr( args, 'cprofile', False ):
+        command += ' --cprofile'
+    if getattr( args, 'kernel_cache_dir', None ):
+        command += ' --kernel_cache_dir ' + args.kernel_cache_dir
+    return command
+
+def lsf_script( dir_name, args, experiment, jobnumbers ):
+    minutes, memory_mb = estimate_resources( experiment )
+    lines = [ '#!/bin/bash',
+        '#BSUB -J "{name}[{indices}]"'.format( name = args.name, 
+            indices = array_indices( jobnumbers, 1 ) ),
+        '#BSUB -W {hours:02d}:{minutes:02d}'.format( hours = minutes // 60, 
+            minutes = minutes % 60 ),
+        '#BSUB -R "rusage[mem={memory}]"'.format( memory = memory_mb ),
+        '#BSUB -o {log}'.format( log = os.path.join( dir_name, 
+            args.name + '_lsf_%I.out' ) ),
+        'cd {dir}'.format( dir = os.path.dirname( os.path.abspath( __file__ ) ) ),
+        onejob_command( args ) ]
+    return '\n'.join( lines ) + '\n'
+
+def slurm_script( dir_name, args, experiment, jobnumbers ):
+    minutes, memory_mb = estimate_resources( experiment )
+    lines = [ '#!/bin/bash',
+        '#SBATCH --job-name={name}'.format( name = args.name ),
+        '#SBATCH --array={indices}'.format( indices = array_indices( jobnumbers, 0 ) ),
+        '#SBATCH --time={hours:02d}:{minutes:02d}:00'.format( hours = minutes // 60, 
+            minutes = minutes % 60 ),
+        '#SBATCH --mem={memory}M'.format( memory = memory_mb ),
+        '#SBATCH --output={log}'.format( log = os.path.join( dir_name, 
+            args.name + '_slurm_%a.out' ) ),
+        'cd {dir}'.format( dir = os.path.dirname( os.path.abspath( __file__ ) ) ),
+        onejob_command( args ) ]
+    return '\n'.join( lines ) + '\n'
+
+'''
+Writes the job script into the experiment folder, returns its filename.
+'''
+def write_job_script( dir_name, args, scheduler_name, script ):
+    script_filename = os.path.join( dir_name, args.name + '_' + scheduler_name 
+        + os.extsep + 'sh' )
+    with open( script_filename, 'w' ) as output:
+        output.write( script )
+    return script_filename
+
+# Patterns of the job id in the output of bsub and sbatch.
+lsf_job_id_pattern = r'Job <(\d+)> is submitted'
+slurm_job_id_pattern = r'Submitted batch job (\d+)'
+
+'''
+Runs the submit command of the scheduler, passing its output through. 
+Returns the job id of the array, parsed from the output with 
+job_id_pattern, or None if not found.
+'''
+def submit( command, script_filename, job_id_pattern, stdin = None ):
+    process = Popen( command, stdin = stdin, stdout = PIPE )
+    output = process.communicate()[0].decode( 'utf-8', 'replace' )
+    print( output.rstrip() )
+    if process.returncode != 0:
+        raise RuntimeError( '{command} failed with code {code} for {script}'.format( 
+            command = command[0], code = process.returncode, 
+            script = script_filename ) )
+
+    match = re.search( job_id_pattern, output )
+    job_id = match.group( 1 ) if match else None
+    print( 'Submitted job array {job_id} ({script})'.format( job_id = job_id, 
+        script = script_filename ) )
+    return job_id
+
+def submit_lsf( dir_name, args, experiment, jobnumbers ):
+    script_filename = write_job_script( dir_name, args, 'lsf', 
+        lsf_script( dir_name, args, experiment, jobnumbers ) )
+    with open( script_filename, 'r' ) as input:
+        submit( [ 'bsub' ], script_filename, lsf_job_id_pattern, stdin = input )
+    return []
+
+def submit_slurm( dir_name, args, experiment, jobnumbers ):
+    script_filename = write_job_script( dir_name, args, 'slurm', 
+        slurm_script( dir_name, args, experiment, jobnumbers ) )
+    submit( [ 'sbatch', script_filename ], script_filename, slurm_job_id_pattern )
+    return []
+
+def dry_run( dir_name, args, experiment, jobnumbers ):
+    minutes, memory_mb = estimate_resources( experiment )
+    print( 'Estimated per job: {minutes} min, {memory} MB'.format( 
+        minutes = minutes, memory = memory_mb ) )
+
+    script_filename = write_job_script( dir_name, args, 'lsf', 
+        lsf_script( dir_name, args, experiment, jobnumbers ) )
+    print( 'LSF:   bsub < ' + script_filename )
+    script_filename = write_job_script( dir_name, args, 'slurm', 
+        slurm_script( dir_name, args, experiment, jobnumbers ) )
+    print( 'Slurm: sbatch ' + script_filename )
+    return []
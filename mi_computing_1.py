@@ -29,8 +29,8 @@ def p_approx_set_given_mu( approx_set, gamma, mu, number_solutions, noise_model
 	if centers_range[0] >= centers_range[1]:
 		return 0.0
 	else:
-		return sum( map( lambda x: noise_models.p_x_given_mu( x, mu, noise_model, 
-			number_solutions ), range( centers_range[0], centers_range[1] ) ) )
+		kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
+		return np.sum( kernel[ centers_range[0]:centers_range[1], mu ] )
 
 '''
 Computes one term of classical mutual information sum.
@@ -38,6 +38,7 @@ Computes one term of classical mutual information sum.
 def compute_one_mutual_inf_term( gamma, experiment, approx_set1, approx_set2, 
 		noise_model ):
 	number_solutions = experiment.number_solutions
+	kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
 
 	p_12 = 0.0
 	p_1 = 0.0
@@ -50,7 +51,7 @@ def compute_one_mutual_inf_term( gamma, experiment, approx_set1, approx_set2,
 			number_solutions, noise_model )
 		curr_p_2_mu = p_approx_set_given_mu( approx_set2, gamma, mu, 
 			number_solutions, noise_model )
-		curr_p_mu = noise_models.p_mu( mu, noise_model, number_solutions ) 
+		curr_p_mu = prior[ mu ]
 		
 		p_12 += curr_p_mu * curr_p_1_mu * curr_p_2_mu
 		p_1 += curr_p_mu * curr_p_1_mu
@@ -0,0 +1,93 @@
+import numpy as np
+import noise_models
+import entropies
+from approx_sets import prefix_sums
+
+'''
+Vectorized version of mi_computing_1: MI between approximation sets 
+considered as vectors.
+
+p( C | mu ) for every approx set C is a range sum of the noise kernel, 
+hence is looked up in its cumulative sums in O(1). The sum over all pairs 
+of sets is then reduced with matrix products:
+	p( C1, C2 ) = sum_mu p(mu) * p( C1 | mu ) * p( C2 | mu )
+i.e. P * diag(p_mu) * P^T, where P[C, mu] = p( C | mu ).
+'''
+
+# Bound on the number of elements of one block of p( C1, C2 ).
+max_block_size = 2**22
+
+# Cache of prefix sums of the kernel over x, keyed by 
+#  (noise_model, number_solutions). Shared by all gammas of a sweep.
+_kernel_prefix_cache = {}
+
+def _kernel_prefix_sums( noise_model, number_solutions ):
+	key = ( noise_model, number_solutions )
+	if key not in _kernel_prefix_cache:
+		kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
+		_kernel_prefix_cache[ key ] = prefix_sums( kernel )
+
+	return _kernel_prefix_cache[ key ]
+
+'''
+Computes p( C_\gamma | \mu) for all approx sets at once. 
+Returns matrix [set, mu], with sets enumerated as in np.triu_indices, 
+see mi_computing_1.p_approx_set_given_mu for the meaning of a set.
+'''
+def p_approx_sets_given_mu( gamma, number_solutions, noise_model ):
+	kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
+	begin, end = np.triu_indices( number_solutions )
+
+	# Possible positions of the approx set center, same rules as in 
+	#  mi_computing_1.p_approx_set_given_mu.
+	centers_begin = np.zeros_like( begin )
+	centers_end = np.full_like( end, number_solutions )
+	centers_begin = np.where( begin > 0, 
+		np.maximum( centers_begin, begin + gamma ), centers_begin )
+	centers_end = np.where( end < number_solutions, 
+		np.minimum( centers_end, end - gamma ), centers_end )
+	centers_end = np.where( begin == 0, 
+		np.minimum( centers_end, begin + gamma ), centers_end )
+	centers_begin = np.where( end == number_solutions, 
+		np.maximum( centers_begin, end - gamma ), centers_begin )
+
+	cumulative = _kernel_prefix_sums( noise_model, number_solutions )
+
+	p_sets = np.zeros( ( len( begin ), number_solutions ) )
+	nonempty = centers_begin < centers_end
+	p_sets[ nonempty ] = ( cumulative[ centers_end[ nonempty ] ] 
+		- cumulative[ centers_begin[ nonempty ] ] )
+
+	return p_sets
+
+'''
+Computes classical mutual information as vectors.
+'''
+def compute_mutual_inf( gamma, experiment ):
+	number_solutions = experiment.number_solutions
+	noise_model = experiment.noise_model
+	kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
+
+	p_sets = p_approx_sets_given_mu( gamma, number_solutions, noise_model )
+
+	# Sets which never occur contribute zero terms only.
+	p_sets = p_sets[ np.any( p_sets != 0, axis = 1 ) ]
+	p_single = np.dot( p_sets, prior )
+	p_sets_weighted = p_sets * prior
+
+	number_sets = len( p_sets )
+	block_rows = max( 1, max_block_size // max( number_sets, 1 ) )
+
+	mutual_inf = 0.0
+	for block_begin in xrange( 0, number_sets, block_rows ):
+		p_12 = np.dot( p_sets_weighted[ block_begin:block_begin + block_rows ], 
+			p_sets.T )
+
+		# Same zero handling as np.allclose( p_12, 0 ) in the loop version.
+		nonzero = np.abs( p_12 ) > entropies.default_zero_tolerance
+		rows, cols = np.nonzero( nonzero )
+
+		mutual_inf += entropies.entropy_sums( p_12[ nonzero ], 
+			block_begin + rows, cols, p_single, p_single )[0]
+
+	return mutual_inf
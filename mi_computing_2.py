@@ -1,58 +1,153 @@
 import numpy as np
-import math
+import scipy.sparse
 import noise_models
-from itertools import izip, product
+import entropies
+import adaptive_sampling
+import random_streams
+from approx_sets import approx_set_weights, window_sums, window_matrix, \
+	p_joint_bandwidth
 
 '''
 Various MI computation functions needed in the experiment.
 The MI is computed as MI between boolean vectors concidered as histograms.
 See notes for more.
+
+The sampled pairs (x1, x2) are counted in a histogram H, every pair adds 
+the rectangle approx_set( x1 ) x approx_set( x2 ) with weight 
+1/( len1 * len2 ), hence
+	p_joint = W * H * W^T,  p_single = W * ( h1 + h2 ) / 2 
+with W from approx_sets.window_matrix and h1, h2 the histograms of x1, x2.
+For banded kernels (see p_joint_bandwidth) H and p_joint are scipy.sparse, 
+otherwise dense and the products with W are window sums.
 '''
 	
+# Number of pairs sampled and accumulated at once.
+batch_size = 2**20
+
+# MI estimate comes with its draws and confidence interval.
+records_sampling = True
+
+'''
+Adds a batch of pairs to the histograms: single_counts is added to in 
+place, so is pair_counts if dense. Returns pair_counts.
+'''
+def count_pairs( pair_counts, single_counts, samples_x1, samples_x2 ):
+	number_solutions = len( single_counts )
+	single_counts += np.bincount( samples_x1, minlength = number_solutions )
+	single_counts += np.bincount( samples_x2, minlength = number_solutions )
+
+	if scipy.sparse.issparse( pair_counts ):
+		return pair_counts + scipy.sparse.coo_matrix( 
+			( np.ones( len( samples_x1 ) ), ( samples_x1, samples_x2 ) ), 
+			shape = pair_counts.shape ).tocsr()
+
+	pair_counts += np.bincount( samples_x1 * number_solutions + samples_x2, 
+		minlength = number_solutions**2 ).reshape( pair_counts.shape )
+	return pair_counts
+
+'''
+Returns W * a * W^T, or W^T * a * W if transposed, for the matrix a.
+'''
+def window_products( a, gamma, transposed = False ):
+	number_solutions = a.shape[0]
+	if scipy.sparse.issparse( a ):
+		window = window_matrix( gamma, number_solutions )
+		if transposed:
+			window = window.T
+		return ( window * a * window.T ).tocsr()
+
+	weights = approx_set_weights( gamma, number_solutions )
+	if transposed:
+		return ( weights[ :, np.newaxis ] * window_sums( window_sums( a, gamma ).T, 
+			gamma ).T * weights[ np.newaxis, : ] )
+	return window_sums( window_sums( weights[ :, np.newaxis ] * a 
+		* weights[ np.newaxis, : ], gamma ).T, gamma ).T
+
+'''
+Returns the normalized p_joint and p_single of the histograms.
+'''
+def smoothed_histograms( pair_counts, single_counts, gamma ):
+	p_joint = window_products( pair_counts, gamma )
+	p_single = window_sums( approx_set_weights( gamma, len( single_counts ) ) 
+		* single_counts, gamma )
+
+	return p_joint / p_joint.sum(), p_single / np.sum( p_single )
+
+'''
+Returns the half width of the confidence interval of the MI estimate, by
+the delta method: to first order every pair changes MI by 
+	g( x1, x2 ) = ( W^T * L * W )[x1, x2],  L = log2( p_joint / ( p_single p_single ) )
+(L on the nonzero entries of p_joint), hence Var( MI ) = Var( g ) / draws.
+'''
+def mutual_inf_ci_halfwidth( p_joint, p_single, pair_counts, gamma, draws ):
+	if scipy.sparse.issparse( p_joint ):
+		p_entries = p_joint.tocoo()
+		nonzero = np.abs( p_entries.data ) > entropies.default_zero_tolerance
+		rows, cols = p_entries.row[ nonzero ], p_entries.col[ nonzero ]
+		log_ratios = scipy.sparse.csr_matrix( ( np.log2( p_entries.data[ nonzero ] 
+			/ ( p_single[ rows ] * p_single[ cols ] ) ), ( rows, cols ) ), 
+			shape = p_joint.shape )
+		changes = window_products( log_ratios, gamma, transposed = True )
+		sum_changes = pair_counts.multiply( changes ).sum()
+		sum_squared_changes = pair_counts.multiply( changes.multiply( changes ) ).sum()
+	else:
+		nonzero = np.abs( p_joint ) > entropies.default_zero_tolerance
+		rows, cols = np.nonzero( nonzero )
+		log_ratios = np.zeros( p_joint.shape )
+		log_ratios[ nonzero ] = np.log2( p_joint[ nonzero ] 
+			/ ( p_single[ rows ] * p_single[ cols ] ) )
+		changes = window_products( log_ratios, gamma, transposed = True )
+		sum_changes = np.sum( pair_counts * changes )
+		sum_squared_changes = np.sum( pair_counts * changes**2 )
+
+	variance = max( sum_squared_changes / draws - ( sum_changes / draws )**2, 0.0 )
+	return adaptive_sampling.confidence_z() * np.sqrt( variance / draws )
+
 '''
 Computes classical mutual information.
+With experiment.tolerance_for_mi set, samples until the confidence 
+interval of MI is within it (at most repetitions_for_mi draws), see 
+adaptive_sampling.
 '''
-def compute_mutual_inf( gamma, experiment ):
+def compute_mutual_inf( gamma, experiment, sampling = None ):
 	
 	number_solutions = experiment.number_solutions
 	noise_model = experiment.noise_model
 	repetitions_for_mi = experiment.repetitions_for_mi
+	tolerance = getattr( experiment, 'tolerance_for_mi', None )
+	adaptive_sampling.check_repetitions( repetitions_for_mi, 'repetitions_for_mi' )
 
-	p_joint = np.zeros( ( number_solutions, number_solutions ) )
-	p_single = np.zeros( number_solutions )
+	if p_joint_bandwidth( gamma, experiment ) is None:
+		pair_counts = np.zeros( ( number_solutions, number_solutions ) )
+	else:
+		pair_counts = scipy.sparse.csr_matrix( ( number_solutions, number_solutions ) )
+	single_counts = np.zeros( number_solutions )
 
-	for k in range( repetitions_for_mi ):
-		# Generate pair x1, x2 and pair of approximation sets
-		[x1, x2] = noise_models.generate_pair( number_solutions, noise_model )
-		as1 = max( x1 - gamma, 0 ), min( x1 + gamma + 1, number_solutions )
-		as2 = max( x2 - gamma, 0 ), min( x2 + gamma + 1, number_solutions )
-		len1 = as1[1] - as1[0]
-		len2 = as2[1] - as2[0]
+	draws = 0
+	ci_halfwidth = None
+	while draws < repetitions_for_mi:
+		target_draws = adaptive_sampling.next_check( draws, repetitions_for_mi, 
+			tolerance )
+		for batch_begin, curr_batch_size in adaptive_sampling.batches( draws, 
+				target_draws, batch_size ):
+			rng = random_streams.batch_stream( experiment, 'mi_computing_2', gamma, 
+				batch_begin )
+			samples_x1, samples_x2, samples_mu = noise_models.generate_pairs( 
+				curr_batch_size, number_solutions, noise_model, rng )
+			pair_counts = count_pairs( pair_counts, single_counts, samples_x1, 
+				samples_x2 )
+		draws = target_draws
 
-		p_joint[ as1[0]:as1[1], as2[0]:as2[1] ] += 1.0/( len1 * len2 )
-		p_single[ as1[0]:as1[1] ] += 0.5 * 1.0/( len1 )
-		p_single[ as2[0]:as2[1] ] += 0.5 * 1.0/( len2 )
+		p_joint, p_single = smoothed_histograms( pair_counts, single_counts, gamma )
+		# A full pass over p_joint, only if the interval is checked or recorded.
+		if tolerance is not None or sampling is not None:
+			ci_halfwidth = mutual_inf_ci_halfwidth( p_joint, p_single, pair_counts, 
+				gamma, draws )
+		if tolerance is not None and ci_halfwidth <= tolerance:
+			break
 
-	p_joint = p_joint / np.sum( p_joint )
-	p_single = p_single / np.sum( p_single )
+	adaptive_sampling.record( sampling, draws, ci_halfwidth )
 
-	mutual_inf = 0.0
-	
-	h_joint = 0.0
-	h_single = 0.0
-
-	for (i, j) in product( xrange( number_solutions ), repeat = 2 ):
-		if np.allclose( p_joint[i,j], 0 ):
-			continue
-
-		# Mutual Inf
-		mutual_inf += p_joint[i,j] * math.log( 
-			p_joint[i,j]/( p_single[i] * p_single[j] ), 2 )
-		
-		# Entropy
-		h_joint += - p_joint[i,j] * math.log( p_joint[i,j], 2 )
-		
-		if not np.allclose( p_single[i], 0 ):
-			h_single += -p_joint[i,j] * math.log( p_single[i], 2 )
-
-	return mutual_inf, p_joint, h_joint, h_single
+	reduction = entropies.joint_entropies( p_joint, p_single, p_single )
+
+	return reduction.mutual_inf, p_joint, reduction.h_joint, reduction.h_rows
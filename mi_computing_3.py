@@ -1,6 +1,6 @@
 import numpy as np
-import math
 import noise_models
+import entropies
 from itertools import izip, product
 
 '''
@@ -16,6 +16,7 @@ def compute_mutual_inf( gamma, experiment ):
 	
 	number_solutions = experiment.number_solutions
 	noise_model = experiment.noise_model
+	kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
 
 	p_joint = np.zeros( ( number_solutions, number_solutions ) )
 
@@ -31,11 +32,8 @@ def compute_mutual_inf( gamma, experiment ):
 			len1 = as1[1] - as1[0]
 			len2 = as2[1] - as2[0]
 
-			p_x1_x2 = 0.0
-			for mu in xrange( number_solutions ):
-				p_x1_x2 += ( noise_models.p_mu( mu, noise_model, number_solutions ) 
-					* noise_models.p_x_given_mu( x1, mu, noise_model, number_solutions )
-					* noise_models.p_x_given_mu( x2, mu, noise_model, number_solutions ) )
+			# Sum over mu of p(mu) * p(x1 | mu) * p(x2 | mu)
+			p_x1_x2 = np.dot( prior, kernel[ x1 ] * kernel[ x2 ] )
 
 			p_joint[i,j] += ( 1.0 / ( len1 * len2 )
 				* p_x1_x2 )
@@ -43,23 +41,6 @@ def compute_mutual_inf( gamma, experiment ):
 
 	p_single = np.sum( p_joint, axis = 0 )
 
-	mutual_inf = 0.0
-	
-	h_joint = 0.0
-	h_single = 0.0
-
-	for (i, j) in product( xrange( number_solutions ), repeat = 2 ):
-		if np.allclose( p_joint[i,j], 0 ):
-			continue
-
-		# Mutual Inf
-		mutual_inf += p_joint[i,j] * math.log( 
-			p_joint[i,j]/( p_single[i] * p_single[j] ), 2 )
-		
-		# Entropy
-		h_joint += - p_joint[i,j] * math.log( p_joint[i,j], 2 )
-		
-		if not np.allclose( p_single[i], 0 ):
-			h_single += -p_joint[i,j] * math.log( p_single[i], 2 )
+	reduction = entropies.joint_entropies( p_joint, p_single, p_single )
 
-	return mutual_inf, p_joint, h_joint, h_single
+	return reduction.mutual_inf, p_joint, reduction.h_joint, reduction.h_rows
@@ -0,0 +1,63 @@
+import numpy as np
+import scipy.sparse
+import noise_models
+import entropies
+from approx_sets import approx_set_weights, window_sums, window_matrix, \
+	p_joint_bandwidth
+
+'''
+Vectorized version of mi_computing_3: the same analytic pairwise MI, but
+computed with matrix algebra instead of the loops over (i, j, x1, x2, mu).
+
+With w[x] = 1/len( approx_set( x ) ) and p_pair = K * diag(p_mu) * K^T 
+(see noise_models.pair_kernel), 
+	p_joint[i, j] = sum_{x1 in W(i), x2 in W(j)} w[x1] * w[x2] * p_pair[x1, x2]
+where W(i) is the gamma-window around i. The window sums are done with 
+cumulative sums, hence p_joint costs O(N^2) once p_pair is known.
+
+For banded kernels (small sigma, debug models) p_joint is a band matrix 
+too, of half bandwidth 2 * ( kernel bandwidth + gamma ). If the band is 
+narrow it is computed as the sparse product W * p_pair * W^T (see 
+approx_sets.window_matrix) and returned as scipy.sparse CSR, so that cost
+and memory scale with N * bandwidth instead of N^2.
+'''
+
+def dense_p_joint( gamma, number_solutions, noise_model ):
+	p_pair = noise_models.pair_kernel( noise_model, number_solutions )
+
+	weights = approx_set_weights( gamma, number_solutions )
+
+	p_weighted = weights[ :, np.newaxis ] * p_pair * weights[ np.newaxis, : ]
+	p_joint = window_sums( window_sums( p_weighted, gamma ).T, gamma ).T
+
+	# p_joint is symmetric, keep it exactly so as the loop version does.
+	return np.triu( p_joint ) + np.triu( p_joint, 1 ).T
+
+def sparse_p_joint( gamma, number_solutions, noise_model ):
+	kernel, prior = noise_models.sparse_noise_kernel( noise_model, 
+		number_solutions )
+	p_pair = kernel * scipy.sparse.diags( prior ) * kernel.T
+
+	window = window_matrix( gamma, number_solutions )
+	p_joint = ( window * p_pair * window.T ).tocsr()
+
+	return ( scipy.sparse.triu( p_joint ) 
+		+ scipy.sparse.triu( p_joint, 1 ).T ).tocsr()
+
+'''
+Computes classical mutual information.
+'''
+def compute_mutual_inf( gamma, experiment ):
+
+	number_solutions = experiment.number_solutions
+	noise_model = experiment.noise_model
+
+	if p_joint_bandwidth( gamma, experiment ) is None:
+		p_joint = dense_p_joint( gamma, number_solutions, noise_model )
+	else:
+		p_joint = sparse_p_joint( gamma, number_solutions, noise_model )
+	p_single = np.asarray( p_joint.sum( axis = 0 ) ).ravel()
+
+	reduction = entropies.joint_entropies( p_joint, p_single, p_single )
+
+	return reduction.mutual_inf, p_joint, reduction.h_joint, reduction.h_rows
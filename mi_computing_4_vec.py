@@ -0,0 +1,52 @@
+import numpy as np
+import scipy.sparse
+import noise_models
+import entropies
+from approx_sets import approx_set_weights, window_sums, window_matrix, \
+	sparse_bandwidth
+
+'''
+Vectorized version of mi_computing_4: MI between the solution sampled from
+the approx set and the input mu.
+
+	p_joint[i, mu] = p(mu) * sum_{x in W(i)} w[x] * p(x | mu)
+with w[x] = 1/len( approx_set( x ) ) and W(i) the gamma-window around i,
+i.e. the product of the band matrix of windows with diag(w) * K * diag(p_mu).
+
+For banded kernels with a narrow band of p_joint (half bandwidth 
+kernel bandwidth + gamma) the product is done with sparse matrices and 
+p_joint is returned as scipy.sparse CSR.
+'''
+
+'''
+Returns the half bandwidth of the sparse p_joint computed for gamma, or 
+None if p_joint is computed dense.
+'''
+def p_joint_bandwidth( gamma, experiment ):
+	bandwidth = noise_models.kernel_bandwidth( experiment.noise_model, 
+		experiment.number_solutions )
+	return sparse_bandwidth( bandwidth + gamma, experiment.number_solutions )
+
+'''
+Computes classical mutual information.
+'''
+def compute_mutual_inf( gamma, experiment ):
+
+	number_solutions = experiment.number_solutions
+	noise_model = experiment.noise_model
+
+	if p_joint_bandwidth( gamma, experiment ) is None:
+		kernel, prior = noise_models.noise_kernel( noise_model, number_solutions )
+
+		weights = approx_set_weights( gamma, number_solutions )
+		p_joint = window_sums( weights[ :, np.newaxis ] * kernel, gamma ) * prior
+	else:
+		kernel, prior = noise_models.sparse_noise_kernel( noise_model, 
+			number_solutions )
+		p_joint = ( window_matrix( gamma, number_solutions ) * kernel 
+			* scipy.sparse.diags( prior ) ).tocsr()
+
+	# Marginals over i and over mu are the sums of p_joint.
+	reduction = entropies.joint_entropies( p_joint )
+
+	return reduction.mutual_inf, p_joint, 0.0, 0.0
@@ -1,11 +1,13 @@
+import os
 import numpy as np
-import scipy.stats
-from scipy.stats import rv_discrete
+import scipy.special
+import scipy.sparse
 import math
-from random import randrange
+
+from common_defs import *
 
 '''
-Various functions devoted to noise modelling of the experiment. 
+Various functions devoted to noise modelling of the experiment.
 So far the noise is generally <mu> + some_noise
 
 mu is distributed uniformly
@@ -13,76 +15,515 @@ mu is distributed uniformly
 'some_noise' is defined by string <noise_model>, which has format
 	trunc-gauss_<sigma>
 		truncated gaussian with sigma
+	laplace_<scale>
+		truncated laplace with scale, discretized as trunc-gauss
+	uniform-window_<half_width>
+		uniform over the solutions within half_width of mu
 	one-peaked-debug_<mu_0>
 		determenistic: all prob concetrated at mu_0, which is fixed itself
 	one-peaked-running-debug
 		mu_0 is running over solutions uniformly, both x' and x'' are in mu_0
+	two-independent
+		x' and x'' uniform over solutions, independently of mu
+	mixture_<weight>_<noise_model>_<weight>_<noise_model>...
+		mixture of the noise models above with the given weights
+
+Every noise model is an object of a class in noise_model_classes, parsed
+once per (noise_model, number_solutions) by get_noise_model. The classes
+compute p( x | mu ), p( mu ) and the cdf vectorized over arrays of x and
+mu, and cache their kernel matrices. Module level functions are shortcuts
+to the parsed model.
 '''
 
 trunc_gauss_nm = 'trunc-gauss'
+laplace_nm = 'laplace'
+uniform_window_nm = 'uniform-window'
 one_peaked_debug_nm = 'one-peaked-debug'
 one_peaked_running_debug_nm = 'one-peaked-running-debug'
 two_independent_solutions_nm = 'two-independent'
+mixture_nm = 'mixture'
 
-def p_mu( mu, noise_model, number_solutions ):
-	noise_model_list = noise_model.split( '_' )
-	if noise_model_list[0] == trunc_gauss_nm:
-		return 1.0/number_solutions
+# Kernel entries p( x | mu ) below this are treated as zeros by the sparse
+#  kernel, the tails of trunc-gauss and laplace are cut off accordingly.
+sparse_kernel_tolerance = 1e-17
+
+# Directory of the on-disk cache of kernels shared between experiments, 
+#  None disables it.
+kernel_cache_dir = None
+
+# Version of the kernel formulas, part of the names of cached kernels. To 
+#  be increased on every change of the kernels, so that kernels cached 
+#  before are not reused.
+kernel_cache_version = 1
+
+# Number of sigmas beyond which trunc-gauss is below sparse_kernel_tolerance,
+#  normalization of the truncated distribution taken into account.
+trunc_gauss_sigmas_cutoff = 9.0
+
+'''
+Base class of the noise models. Subclasses define pmf, cdf and, unless
+mu is uniform, prior; bandwidth if the kernel is banded. parameters are
+the names of the float parameters following the name in the spec string.
+All methods take arrays of x and mu, which are broadcast together, and
+are 0 outside of solution space.
+'''
+class NoiseModel( object ):
+	name = None
+	parameters = []
+
+	def __init__( self, number_solutions ):
+		self.number_solutions = number_solutions
+		self._cache = {}
+
+	'''
+	Parses the parameters of the model from the beginning of tokens.
+	Returns pair (model, remaining tokens).
+	'''
+	@classmethod
+	def from_tokens( cls, tokens, number_solutions ):
+		count = len( cls.parameters )
+		if len( tokens ) < count:
+			raise ValueError( 'Noise model {name} needs parameters: {parameters}'.format(
+				name = cls.name, parameters = ', '.join( cls.parameters ) ) )
+		return ( cls( number_solutions, *[ float( token ) for token in tokens[:count] ] ),
+			tokens[count:] )
+
+	def inside( self, x ):
+		return ( x >= 0 ) & ( x <= self.number_solutions - 1 )
+
+	'''
+	p( x | mu ).
+	'''
+	def pmf( self, x, mu ):
+		raise NotImplementedError
+
+	'''
+	p( x' <= x | mu ).
+	'''
+	def cdf( self, x, mu ):
+		raise NotImplementedError
+
+	'''
+	p( mu ), uniform by default.
+	'''
+	def prior( self, mu ):
+		mu = np.asarray( mu )
+		return np.where( self.inside( mu ), 1.0/self.number_solutions, 0.0 )
+
+	'''
+	Returns bandwidth b of the kernel: p( x | mu ) is zero (or below
+	sparse_kernel_tolerance) for | x - mu | > b. Equals number_solutions - 1
+	if the kernel is not banded.
+	'''
+	def bandwidth( self ):
+		return self.number_solutions - 1
+
+	'''
+	Returns pair (p_x_given_mu_matrix, p_mu_vector) for all x, mu in the
+	solution space, computed once and read-only.
+	'''
+	def kernel( self ):
+		if 'kernel' not in self._cache:
+			kernel = self.kernel_matrix()
+			prior = self.prior( np.arange( self.number_solutions ) )
+			kernel.setflags( write = False )
+			prior.setflags( write = False )
+			self._cache[ 'kernel' ] = ( kernel, prior )
+
+		return self._cache[ 'kernel' ]
+
+	'''
+	Computes p_x_given_mu_matrix of kernel.
+	'''
+	def kernel_matrix( self ):
+		solutions = np.arange( self.number_solutions )
+		return self.pmf( solutions[ :, np.newaxis ], solutions[ np.newaxis, : ] )
+
+	'''
+	Returns the matrix p_pair[x1, x2] = sum_mu p(mu) * p(x1 | mu) * p(x2 | mu),
+	i.e. the joint distribution of two noisy solutions generated from the
+	same mu. Computed as K * diag(p_mu) * K^T once and read-only.
+	'''
+	def pair_kernel( self ):
+		if 'pair_kernel' not in self._cache:
+			kernel, prior = self.kernel()
+			p_pair = np.dot( kernel * prior, kernel.T )
+			p_pair.setflags( write = False )
+			self._cache[ 'pair_kernel' ] = p_pair
+
+		return self._cache[ 'pair_kernel' ]
+
+	'''
+	Sparse version of kernel for banded kernels: the matrix is
+	scipy.sparse CSC with entries only within bandwidth of the diagonal.
+	Never builds the dense N x N kernel of banded models, hence memory is
+	O(N * bandwidth).
+	'''
+	def sparse_kernel( self ):
+		if 'sparse_kernel' not in self._cache:
+			number_solutions = self.number_solutions
+			bandwidth = self.bandwidth()
+			mu = np.arange( number_solutions )
+
+			if 2 * bandwidth + 1 < number_solutions:
+				x = mu[ np.newaxis, : ] + np.arange( -bandwidth, bandwidth + 1 )[ :, np.newaxis ]
+				inside = self.inside( x )
+				values = self.pmf( x, mu[ np.newaxis, : ] )
+				kernel = scipy.sparse.csc_matrix( ( values[ inside ],
+					( x[ inside ], np.broadcast_to( mu, x.shape )[ inside ] ) ),
+					shape = ( number_solutions, number_solutions ) )
+				kernel.eliminate_zeros()
+				prior = self.prior( mu )
+			else:
+				kernel, prior = self.kernel()
+				kernel = scipy.sparse.csc_matrix( kernel )
+
+			self._cache[ 'sparse_kernel' ] = ( kernel, prior )
+
+		return self._cache[ 'sparse_kernel' ]
+
+	'''
+	Returns (kernel_cdf, starts, prior_cdf): the cdf of p( x | mu ) over x
+	from starts[mu] on, for every mu (only the band for banded kernels,
+	i.e. 2 * bandwidth + 1 rows, otherwise N), and the cdf of p_mu. Last
+	entries are set to exactly 1, so that inverse-CDF lookup never runs
+	out of the solution space.
+	'''
+	def sampling_cdfs( self ):
+		if 'sampling_cdfs' not in self._cache:
+			number_solutions = self.number_solutions
+			width = min( 2 * self.bandwidth() + 1, number_solutions )
+			mu = np.arange( number_solutions )
+			starts = np.clip( mu - self.bandwidth(), 0, number_solutions - width )
+
+			x = starts[ np.newaxis, : ] + np.arange( width )[ :, np.newaxis ]
+			kernel_cdf = ( self.cdf( x, mu[ np.newaxis, : ] )
+				- self.cdf( starts - 1, mu )[ np.newaxis, : ] )
+			kernel_cdf /= kernel_cdf[-1]
+			prior_cdf = np.cumsum( self.prior( mu ) )
+			prior_cdf /= prior_cdf[-1]
+			self._cache[ 'sampling_cdfs' ] = ( kernel_cdf, starts, prior_cdf )
+
+		return self._cache[ 'sampling_cdfs' ]
+
+	'''
+	Generates a batch of n independent triples (x1, x2, mu): mu is drawn
+	from p_mu, then x1 and x2 are drawn independently from p( x | mu ).
+	Returns three integer arrays of length n.
+	rng is the source of randomness, anything with uniform( size = ... )
+	such as np.random.RandomState; np.random itself is used by default.
+	'''
+	def sample( self, n, rng = None ):
+		if rng is None:
+			rng = np.random
+		kernel_cdf, starts, prior_cdf = self.sampling_cdfs()
+
+		mu = np.searchsorted( prior_cdf, rng.uniform( size = n ), side = 'right' )
+		uniform = rng.uniform( size = ( 2, n ) )
+		x = np.empty( ( 2, n ), dtype = int )
+
+		# Inverse-CDF lookup in the column of the respective mu; samples are
+		#  grouped by mu, so that every column is searched once.
+		order = np.argsort( mu, kind = 'mergesort' )
+		counts = np.bincount( mu, minlength = self.number_solutions )
+		group_ends = np.cumsum( counts )
+		for curr_mu in np.flatnonzero( counts ):
+			group = order[ group_ends[ curr_mu ] - counts[ curr_mu ]:group_ends[ curr_mu ] ]
+			x[ :, group ] = starts[ curr_mu ] + np.searchsorted(
+				kernel_cdf[ :, curr_mu ], uniform[ :, group ], side = 'right' )
+
+		return x[0], x[1], mu
+
+'''
+Symmetric continuous distribution around mu with the given scale, 
+truncated to [0, N - 1] and discretized: p( x | mu ) is its mass in 
+[x - 0.5, x + 0.5] (clipped to [0, N - 1]), renormalized. Subclasses 
+define standard_tail of the distribution with scale 1.
+
+Masses are differences of the cdf at the interval boundaries. Taking them
+from the smaller tail on either side of mu avoids the cancellation of 
+differences of cdf's close to 1, so that the far tails keep their 
+relative precision.
+'''
+class TruncatedContinuousNoise( NoiseModel ):
+	parameters = [ 'scale' ]
+
+	def __init__( self, number_solutions, scale ):
+		NoiseModel.__init__( self, number_solutions )
+		self.scale = scale
+
+	'''
+	Standard cdf at -| t |, i.e. the smaller tail.
+	'''
+	def standard_tail( self, t ):
+		raise NotImplementedError
+
+	def standard_cdf( self, t ):
+		tail = self.standard_tail( t )
+		return np.where( t > 0, 1.0 - tail, tail )
+
+	'''
+	Masses of the standard distribution between consecutive boundaries t
+	(ascending along axis 0), from one evaluation of the tail at all of 
+	them.
+	'''
+	def standard_masses( self, t ):
+		tail = self.standard_tail( t )
+		below, above = tail[:-1], tail[1:]
+		below_positive, above_positive = t[:-1] > 0, t[1:] > 0
+		return np.where( below_positive, below - above, 
+			np.where( above_positive, 1.0 - above - below, above - below ) )
+
+	def cdf( self, x, mu ):
+		x = np.asarray( x, dtype = float )
+		mu = np.asarray( mu, dtype = float )
+		right = self.number_solutions - 1
+
+		# Truncation, both at the distribution and the discretization level.
+		lower = self.standard_cdf( ( 0 - mu ) / self.scale )
+		upper = self.standard_cdf( ( right - mu ) / self.scale )
+		value = self.standard_cdf( ( np.minimum( x + 0.5, right ) - mu ) / self.scale )
+		return np.clip( ( value - lower ) / ( upper - lower ), 0.0, 1.0 )
+
+	# Take into account that we need to discretize, hence using
+	#  difference of two cdf's
+	def pmf( self, x, mu ):
+		x, mu = np.broadcast_arrays( np.asarray( x, dtype = float ), 
+			np.asarray( mu, dtype = float ) )
+		right = self.number_solutions - 1
+		boundaries = np.array( [ np.zeros_like( x ), np.maximum( x - 0.5, 0 ), 
+			np.minimum( x + 0.5, right ), np.full_like( x, right ) ] )
+		masses = self.standard_masses( ( boundaries - mu ) / self.scale )
+		return np.where( self.inside( x ), masses[1] / np.sum( masses, axis = 0 ), 0.0 )
+
+	'''
+	The whole kernel from one evaluation at the grid of the N + 1 
+	half-integer boundaries (clipped to [0, N - 1]) times N mu's.
+	'''
+	def kernel_matrix( self ):
+		number_solutions = self.number_solutions
+		boundaries = np.clip( np.arange( number_solutions + 1 ) - 0.5, 0, 
+			number_solutions - 1 )
+		mu = np.arange( number_solutions )
+		masses = self.standard_masses( ( boundaries[ :, np.newaxis ] 
+			- mu[ np.newaxis, : ] ) / self.scale )
+		return masses / np.sum( masses, axis = 0 )
+
+class TruncGaussNoise( TruncatedContinuousNoise ):
+	name = trunc_gauss_nm
+	parameters = [ 'sigma' ]
+
+	def standard_tail( self, t ):
+		return scipy.special.ndtr( -np.abs( t ) )
+
+	def bandwidth( self ):
+		bandwidth = int( math.ceil( trunc_gauss_sigmas_cutoff * self.scale + 0.5 ) )
+		return min( bandwidth, self.number_solutions - 1 )
 
-	if noise_model_list[0] == one_peaked_debug_nm:
-		mu_0 = float( noise_model_list[1] )
-		if np.allclose( mu, 0 ):
-			return 1.0
-		else:
-			return 0.0
+	'''
+	Cached on disk in kernel_cache_dir per (kernel_cache_version, sigma, N), 
+	memory-mapped read-only when loaded from there.
+	'''
+	def kernel_matrix( self ):
+		if kernel_cache_dir is None:
+			return TruncatedContinuousNoise.kernel_matrix( self )
 
-	if noise_model_list[0] == one_peaked_running_debug_nm:
-		return 1.0/number_solutions
+		filename = os.path.join( kernel_cache_dir, 
+			'{name}_v{version}_{sigma!r}_{solutions}'.format( name = self.name, 
+			version = kernel_cache_version, sigma = float( self.scale ), 
+			solutions = self.number_solutions ) + os.extsep + numpy_array_suffix )
+		if not os.path.exists( filename ):
+			# Written under a temporary name first, so that concurrent jobs 
+			#  never read a truncated kernel.
+			temporary_filename = '{filename}.{pid}.tmp'.format( filename = filename, 
+				pid = os.getpid() )
+			with open( temporary_filename, 'wb' ) as output:
+				np.save( output, TruncatedContinuousNoise.kernel_matrix( self ) )
+			os.rename( temporary_filename, filename )
 
-	if noise_model_list[0] == two_independent_solutions_nm:
-		return 1.0/number_solutions
+		return np.load( filename, mmap_mode = 'r' )
+
+class LaplaceNoise( TruncatedContinuousNoise ):
+	name = laplace_nm
+
+	def standard_tail( self, t ):
+		return 0.5 * np.exp( -np.abs( t ) )
+
+	def bandwidth( self ):
+		bandwidth = int( math.ceil(
+			-math.log( sparse_kernel_tolerance ) * self.scale + 0.5 ) )
+		return min( bandwidth, self.number_solutions - 1 )
+
+class UniformWindowNoise( NoiseModel ):
+	name = uniform_window_nm
+	parameters = [ 'half_width' ]
+
+	def __init__( self, number_solutions, half_width ):
+		NoiseModel.__init__( self, number_solutions )
+		self.half_width = int( half_width )
+
+	def window( self, mu ):
+		mu = np.asarray( mu )
+		return ( np.maximum( mu - self.half_width, 0 ),
+			np.minimum( mu + self.half_width, self.number_solutions - 1 ) )
+
+	def pmf( self, x, mu ):
+		x = np.asarray( x )
+		begin, end = self.window( mu )
+		return np.where( ( x >= begin ) & ( x <= end ), 1.0 / ( end - begin + 1 ), 0.0 )
+
+	def cdf( self, x, mu ):
+		begin, end = self.window( mu )
+		return np.clip( ( np.asarray( x ) - begin + 1.0 ) / ( end - begin + 1 ), 0.0, 1.0 )
+
+	def bandwidth( self ):
+		return min( self.half_width, self.number_solutions - 1 )
+
+class OnePeakedDebugNoise( NoiseModel ):
+	name = one_peaked_debug_nm
+	parameters = [ 'mu_0' ]
+
+	def __init__( self, number_solutions, mu_0 ):
+		NoiseModel.__init__( self, number_solutions )
+		self.mu_0 = mu_0
+
+	def pmf( self, x, mu ):
+		return np.where( np.asarray( x ) == np.asarray( mu ), 1.0, 0.0 )
+
+	def cdf( self, x, mu ):
+		return np.where( np.asarray( x ) >= np.asarray( mu ), 1.0, 0.0 )
+
+	# All prob is at mu = 0, mu_0 is not used so far.
+	def prior( self, mu ):
+		return np.where( np.asarray( mu ) == 0, 1.0, 0.0 )
+
+	def bandwidth( self ):
+		return 0
+
+class OnePeakedRunningDebugNoise( OnePeakedDebugNoise ):
+	name = one_peaked_running_debug_nm
+	parameters = []
+
+	def __init__( self, number_solutions ):
+		NoiseModel.__init__( self, number_solutions )
+
+	def prior( self, mu ):
+		return NoiseModel.prior( self, mu )
+
+class TwoIndependentNoise( NoiseModel ):
+	name = two_independent_solutions_nm
+
+	def pmf( self, x, mu ):
+		x, mu = np.broadcast_arrays( x, mu )
+		return np.where( self.inside( x ), 1.0/self.number_solutions, 0.0 )
+
+	def cdf( self, x, mu ):
+		x, mu = np.broadcast_arrays( x, mu )
+		return np.clip( ( x + 1.0 ) / self.number_solutions, 0.0, 1.0 )
+
+'''
+Mixture of noise models; the spec is a list of (weight, noise model)
+pairs, hence it takes all the remaining tokens.
+'''
+class MixtureNoise( NoiseModel ):
+	name = mixture_nm
+
+	def __init__( self, number_solutions, weights, components ):
+		NoiseModel.__init__( self, number_solutions )
+		self.weights = np.asarray( weights, dtype = float ) / np.sum( weights )
+		self.components = components
+
+	@classmethod
+	def from_tokens( cls, tokens, number_solutions ):
+		weights, components = [], []
+		while tokens:
+			weights.append( float( tokens[0] ) )
+			component, tokens = _parse_tokens( tokens[1:], number_solutions )
+			components.append( component )
+		if not components:
+			raise ValueError( 'Noise model {name} needs components'.format(
+				name = cls.name ) )
+		return cls( number_solutions, weights, components ), tokens
+
+	def _mixed( self, method, *args ):
+		return sum( weight * getattr( component, method )( *args )
+			for weight, component in zip( self.weights, self.components ) )
+
+	def pmf( self, x, mu ):
+		return self._mixed( 'pmf', x, mu )
+
+	def cdf( self, x, mu ):
+		return self._mixed( 'cdf', x, mu )
+
+	def prior( self, mu ):
+		return self._mixed( 'prior', mu )
+
+	def bandwidth( self ):
+		return max( component.bandwidth() for component in self.components )
+
+noise_model_classes = {
+	trunc_gauss_nm: TruncGaussNoise,
+	laplace_nm: LaplaceNoise,
+	uniform_window_nm: UniformWindowNoise,
+	one_peaked_debug_nm: OnePeakedDebugNoise,
+	one_peaked_running_debug_nm: OnePeakedRunningDebugNoise,
+	two_independent_solutions_nm: TwoIndependentNoise,
+	mixture_nm: MixtureNoise,
+}
+
+def _parse_tokens( tokens, number_solutions ):
+	if not tokens or tokens[0] not in noise_model_classes:
+		raise ValueError( 'Unknown noise model: ' + '_'.join( tokens ) )
+	return noise_model_classes[ tokens[0] ].from_tokens( tokens[1:],
+		number_solutions )
+
+# Cache of parsed noise models, keyed by (noise_model, number_solutions).
+_model_cache = {}
+
+'''
+Returns the noise model object of the spec string noise_model, parsed
+once per (noise_model, number_solutions).
+'''
+def get_noise_model( noise_model, number_solutions ):
+	key = ( noise_model, number_solutions )
+	if key not in _model_cache:
+		model, tokens = _parse_tokens( noise_model.split( '_' ), number_solutions )
+		if tokens:
+			raise ValueError( 'Unknown noise model: ' + noise_model )
+		_model_cache[ key ] = model
+
+	return _model_cache[ key ]
+
+def p_mu( mu, noise_model, number_solutions ):
+	return get_noise_model( noise_model, number_solutions ).prior( mu )
 
 '''
 Returns 0 outside of solution space
 '''
 def p_x_given_mu( x, mu, noise_model, number_solutions ):
-	noise_model_list = noise_model.split( '_' )
-	
-	if noise_model_list[0] == trunc_gauss_nm:
-		sigma = float( noise_model_list[1] )
-		left, right = 0, number_solutions - 1
-		left_truncated = (left - mu) / sigma
-		right_truncated = (right - mu) / sigma
-
-		# Take into account that we need to discretize, hence using
-		#  difference of two cdf's
-		return ( scipy.stats.truncnorm.cdf( x + 0.5, left_truncated, right_truncated,
-			loc = mu, scale = sigma )  
-			- scipy.stats.truncnorm.cdf( x - 0.5, left_truncated, right_truncated,
-			loc = mu, scale = sigma ) )
-
-	if noise_model_list[0] == one_peaked_debug_nm:
-		if np.allclose( x, mu ):
-			return 1.0
-		else:
-			return 0.0
-
-	if noise_model_list[0] == one_peaked_running_debug_nm:
-		if np.allclose( x, mu ):
-			return 1.0
-		else:
-			return 0.0
-
-	if noise_model_list[0] == two_independent_solutions_nm:
-		return 1.0/number_solutions
+	return get_noise_model( noise_model, number_solutions ).pmf( x, mu )
 
-def generate_pair( number_solutions, noise_model ):
-	mu = randrange( number_solutions )
+'''
+Returns pair (p_x_given_mu_matrix, p_mu_vector) with
+	p_x_given_mu_matrix[x, mu] == p_x_given_mu( x, mu, ... )
+	p_mu_vector[mu] == p_mu( mu, ... )
+for all x, mu in the solution space, see NoiseModel.kernel.
+'''
+def noise_kernel( noise_model, number_solutions ):
+	return get_noise_model( noise_model, number_solutions ).kernel()
+
+def pair_kernel( noise_model, number_solutions ):
+	return get_noise_model( noise_model, number_solutions ).pair_kernel()
+
+def sparse_noise_kernel( noise_model, number_solutions ):
+	return get_noise_model( noise_model, number_solutions ).sparse_kernel()
 
-	xk = np.arange( number_solutions )
-	pk = map( lambda x: p_x_given_mu( x, mu, noise_model, 
-		number_solutions ), xk )
-	
-	rv = rv_discrete( name='custm', values = ( xk, pk ) )
+def kernel_bandwidth( noise_model, number_solutions ):
+	return get_noise_model( noise_model, number_solutions ).bandwidth()
 
-	return ( rv.rvs(), rv.rvs(), mu )
\ No newline at end of file
+def generate_pairs( n, number_solutions, noise_model, rng = None ):
+	return get_noise_model( noise_model, number_solutions ).sample( n, rng )
+
+def generate_pair( number_solutions, noise_model ):
+	x1, x2, mu = generate_pairs( 1, number_solutions, noise_model )
+	return ( x1[0], x2[0], mu[0] )
@@ -4,8 +4,12 @@ from matplotlib import rc, rcParams
 import os
 from subprocess import call
 import pickle
+import json
+import hashlib
+import multiprocessing
 
 from common_defs import *
+import result_store
 
 title_font = 22
 legend_font = 22
@@ -13,21 +17,203 @@ axis_font = 25
 ticks_font = 22
 line_width = 2.0
 
-rc('text', usetex=True)
-rcParams['text.latex.preamble'] = [r"\usepackage{amsmath}"]
+# Outputs of the p_joint heatmaps: one figure per gamma, one multipage PDF
+#  or one figure with the tiled heatmaps of all gammas.
+p_joint_outputs = [ 'files', 'multipage', 'tiled' ]
+
+'''
+Sets up LaTeX text rendering, and switches off the interactive mode of 
+matplotlibrc, in which pyplot redraws the figure on every call; done on 
+plotting, not on import.
+'''
+def setup_plotting():
+    plt.ioff()
+    rc('text', usetex=True)
+    rcParams['text.latex.preamble'] = [r"\usepackage{amsmath}"]
+
+def p_joint_title( experiment, gamma ):
+    title_template = r'name: {name}' '\n' r'noise model: {noisemod}' '\n' \
+        r'solutions: {solutions}; $\gamma$ value:{gammaval}' '\n' \
+        r'MI type: {mi_computing_type}'
+    return title_template.format( 
+        name = experiment.name.replace('_', r'\_'), 
+        noisemod = experiment.noise_model.replace('_', r'\_'),
+        solutions = str( experiment.number_solutions ),
+        gammaval= str( gamma ), 
+        mi_computing_type = experiment.mi_computing_type.replace('_', r'\_') )
+
+def p_joint_figure_filename( figures_dir_name, experiment, gamma ):
+    figure_filename = '{name}__p_joint__gamma{gamma}.eps'.format( 
+        name = experiment.name, gamma = str( gamma ) )
+    return os.path.join( figures_dir_name, figure_filename )
+
+'''
+Draws p_joint as an image, oriented as pcolor would draw it, which is much
+faster for large N. Without interpolation the vector formats embed the
+N x N image as is, rather than resampled to the dpi.
+'''
+def draw_p_joint( ax, p_joint ):
+    number_solutions = p_joint.shape[0]
+    return ax.imshow( p_joint, origin = 'lower', interpolation = 'none',
+        extent = ( 0, number_solutions, 0, number_solutions ) )
+
+'''
+Adds the colorbar of the image. Its colors are kept vector, matplotlib
+would rasterize them at the dpi of the figure.
+'''
+def colorbar( image ):
+    bar = plt.colorbar( image )
+    bar.solids.set_rasterized( False )
+    return bar
+
+'''
+Plots the p_joint heatmap of gamma k into its own file. Runs in a pool 
+worker, hence reads its p_joint from the memory-mapped final result.
+'''
+def plot_p_joint_job( job ):
+    dir_name, figures_dir_name, experiment, k = job
+    setup_plotting()
+    final_result = result_store.load_final_result( dir_name, experiment.name )
+
+    fig = plt.figure()
+    ax = fig.add_subplot( 1, 1, 1, aspect='equal' )
+    ax.set_title( p_joint_title( experiment, experiment.job_gammas[k] ), 
+        fontsize=title_font )
+    colorbar( draw_p_joint( ax, result_store.p_joint_matrix( final_result, k ) ) )
+    plt.tight_layout()
+
+    figure_filename = p_joint_figure_filename( figures_dir_name, experiment, 
+        experiment.job_gammas[k] )
+    plt.savefig( figure_filename, format='eps', dpi=600 )
+    plt.close()
+
+'''
+Returns the digest of what the p_joint heatmap of gamma k shows: its 
+p_joint and title.
+'''
+def p_joint_digest( experiment, final_result, k ):
+    digest = hashlib.sha1( np.ascontiguousarray( final_result.p_joint_final[k] ) )
+    digest.update( p_joint_title( experiment, 
+        experiment.job_gammas[k] ).encode( 'utf-8' ) )
+    return digest.hexdigest()
+
+def p_joint_digests_filename( figures_dir_name, experiment ):
+    return os.path.join( figures_dir_name, experiment.name + '__p_joint__digests' 
+        + os.extsep + json_suffix )
+
+'''
+Plots the p_joint heatmaps of all gammas, see p_joint_outputs for 
+args.p_joint_output. Per gamma files are plotted by args.plot_workers 
+processes (all cores by default). Figures of gammas whose p_joint did 
+not change since they were plotted are kept, unless args.replot. Returns 
+the written files.
+'''
+def plot_p_joints( dir_name, figures_dir_name, experiment, final_result, args ):
+    setup_plotting()
+    p_joint_output = getattr( args, 'p_joint_output', None ) or p_joint_outputs[0]
+    digests_filename = p_joint_digests_filename( figures_dir_name, experiment )
+    plotted_digests = {}
+    if os.path.exists( digests_filename ) and not getattr( args, 'replot', False ):
+        with open( digests_filename, 'r' ) as input:
+            plotted_digests = json.load( input )
+
+    number_gammas = len( experiment.job_gammas )
+    keys = [ p_joint_output + '_' + str( gamma ) for gamma in experiment.job_gammas ]
+    digests = [ p_joint_digest( experiment, final_result, k ) 
+        for k in range( number_gammas ) ]
+    if p_joint_output == 'files':
+        figure_filenames = [ p_joint_figure_filename( figures_dir_name, 
+            experiment, gamma ) for gamma in experiment.job_gammas ]
+    else:
+        figure_filenames = [ p_joint_sheet_filename( figures_dir_name, experiment, 
+            p_joint_output ) ] * number_gammas
+    changed_jobs = [ k for k in range( number_gammas ) 
+        if digests[k] != plotted_digests.get( keys[k] ) 
+        or not os.path.exists( figure_filenames[k] ) ]
+
+    if p_joint_output == 'files':
+        jobs = [ ( dir_name, figures_dir_name, experiment, k ) for k in changed_jobs ]
+        workers = getattr( args, 'plot_workers', None ) or multiprocessing.cpu_count()
+        if workers > 1 and len( jobs ) > 1:
+            pool = multiprocessing.Pool( processes = min( workers, len( jobs ) ) )
+            try:
+                pool.map( plot_p_joint_job, jobs )
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                plot_p_joint_job( job )
+        written = [ figure_filenames[k] for k in changed_jobs ]
+    elif changed_jobs:
+        plot_p_joint_sheet( figure_filenames[0], experiment, final_result, 
+            p_joint_output )
+        written = figure_filenames[:1]
+    else:
+        written = []
+
+    plotted_digests.update( zip( keys, digests ) )
+    with open( digests_filename, 'w' ) as output:
+        json.dump( plotted_digests, output, indent = 1, sort_keys = True )
+
+    print( 'p_joint heatmaps: {plotted} plotted, {kept} unchanged'.format( 
+        plotted = len( changed_jobs ), 
+        kept = len( experiment.job_gammas ) - len( changed_jobs ) ) )
+    return written
+
+def p_joint_sheet_filename( figures_dir_name, experiment, p_joint_output ):
+    if p_joint_output == 'multipage':
+        return os.path.join( figures_dir_name, 
+            experiment.name + '__p_joint' + os.extsep + 'pdf' )
+    return os.path.join( figures_dir_name, 
+        experiment.name + '__p_joint__tiled' + os.extsep + 'png' )
+
+'''
+Plots the p_joint heatmaps of all gammas into one multipage PDF, one page
+per gamma, or one tiled figure.
+'''
+def plot_p_joint_sheet( figure_filename, experiment, final_result, p_joint_output ):
+    number_gammas = len( experiment.job_gammas )
+    if p_joint_output == 'multipage':
+        from matplotlib.backends.backend_pdf import PdfPages
+        with PdfPages( figure_filename ) as pages:
+            for k in range( number_gammas ):
+                fig = plt.figure()
+                ax = fig.add_subplot( 1, 1, 1, aspect='equal' )
+                ax.set_title( p_joint_title( experiment, experiment.job_gammas[k] ), 
+                    fontsize=title_font )
+                colorbar( draw_p_joint( ax, 
+                    result_store.p_joint_matrix( final_result, k ) ) )
+                plt.tight_layout()
+                pages.savefig( fig )
+                plt.close()
+        return
+
+    columns = int( np.ceil( np.sqrt( number_gammas ) ) )
+    rows = int( np.ceil( number_gammas / float( columns ) ) )
+    fig, axes = plt.subplots( rows, columns, figsize = ( 3 * columns, 3 * rows ), 
+        squeeze = False )
+    for k, ax in enumerate( axes.flat ):
+        if k < number_gammas:
+            draw_p_joint( ax, result_store.p_joint_matrix( final_result, k ) )
+            ax.set_title( r'$\gamma$ = {gamma}'.format( 
+                gamma = experiment.job_gammas[k] ), fontsize=ticks_font )
+        ax.set_axis_off()
+    plt.tight_layout()
+    plt.savefig( figure_filename, format='png', dpi=150 )
+    plt.close()
 
 def plot_mutual_information( dir_name, figures_dir_name, args ):
+    setup_plotting()
+
     # Open experiment setting
     pickle_filename = os.path.join( dir_name, args.name + '_' 
         + experiment_setting_filename + os.extsep + pickle_suffix )
     with open( pickle_filename, 'rb') as input:
         experiment = pickle.load( input )
 
-    # Open results
-    pickle_filename = os.path.join( dir_name, args.name + '_' 
-        + experiment_finalresult_filename + os.extsep + pickle_suffix )
-    with open( pickle_filename, 'rb' ) as input:
-        final_result = pickle.load( input )
+    # Open results, p_joint is memory-mapped and read per gamma
+    final_result = result_store.load_final_result( dir_name, args.name )
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
@@ -84,34 +270,8 @@ def plot_mutual_information( dir_name, figures_dir_name, args ):
 
     # ###########################################################
     
-    for k in range( len( experiment.job_gammas ) ):
-        fig = plt.figure()
-        ax = fig.add_subplot( 1, 1, 1, aspect='equal' )
-        title_template = r'name: {name}' '\n' r'noise model: {noisemod}' '\n' \
-            r'solutions: {solutions}; $\gamma$ value:{gammaval}' '\n' \
-            r'MI type: {mi_computing_type}'
-        title_template = title_template.format( 
-            name = experiment.name.replace('_', r'\_'), 
-            noisemod = experiment.noise_model.replace('_', r'\_'),
-            solutions = str( experiment.number_solutions ),
-            gammaval= str( experiment.job_gammas[k] ), 
-            mi_computing_type = experiment.mi_computing_type.replace('_', r'\_') )
-        
-        ax.set_title( title_template, fontsize=title_font )
-        plt.pcolor( final_result.p_joint_final[ experiment.job_gammas[k] ] )
-        plt.colorbar()
-
-        plt.tight_layout()
-
-        figure_filename = '{name}__p_joint__gamma{gamma}.eps'
-        figure_filename = figure_filename.format( name = experiment.name, 
-            noisemod = experiment.noise_model,
-            gamma = str( experiment.job_gammas[k] ) )
-
-        figure_filename = os.path.join( figures_dir_name, figure_filename )
-        plt.savefig( figure_filename, format='eps', dpi=600 )
-        plt.close()
-
+    for figure_filename in plot_p_joints( dir_name, figures_dir_name, 
+            experiment, final_result, args ):
         if args.gitcommit:  
             call( ['git', 'add', figure_filename ] )
 
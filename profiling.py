@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import resource
+import cProfile
+from contextlib import contextmanager
+
+from common_defs import *
+
+'''
+Instrumentation of the job pipeline: wall time, CPU time and peak RSS
+per phase.
+
+A profile is a dict { 'phases': { phase: { 'wall', 'cpu', 'peak_rss_mb' } } }
+filled in by
+	with profiling.phase( profile, 'phase name' ):
+		...
+A repeated phase accumulates its times, phases may be nested. On Linux
+the peak RSS is reset at the beginning of every phase (see
+reset_peak_rss), so it is the peak within the phase; elsewhere it is the
+peak of the process so far.
+
+The profiles of jobs are stored with their job results (as JSON, see
+dumps) and in the manifest, and merged into the final result (see
+result_store), sweep_summary reports on them. run_profiled captures
+cProfile stats of a call. startup_phase measures the startup of the
+process (interpreter and imports).
+'''
+
+# Number of the slowest gammas listed by sweep_summary.
+summary_slowest = 5
+
+# Peak RSS so far of every open phase, innermost last. A reset of the peak
+#  folds it into the open phases first.
+_open_phase_peaks = []
+
+def new_profile():
+    return { 'phases': {} }
+
+'''
+Resets the peak RSS of the process to its current RSS, where the system
+supports it.
+'''
+def reset_peak_rss():
+    fold_peak_rss()
+    try:
+        with open( '/proc/self/clear_refs', 'w' ) as clear_refs:
+            clear_refs.write( '5' )
+    except ( IOError, OSError ):
+        pass
+
+'''
+Returns the peak RSS of the process in MB.
+'''
+def peak_rss_mb():
+    try:
+        with open( '/proc/self/status', 'r' ) as status:
+            for line in status:
+                if line.startswith( 'VmHWM:' ):
+                    return int( line.split()[1] ) / 1024.0
+    except ( IOError, OSError ):
+        pass
+
+    # ru_maxrss is in KB on Linux, in bytes on OS X.
+    peak_rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    if os.uname()[0] == 'Darwin':
+        peak_rss /= 1024.0
+    return peak_rss / 1024.0
+
+'''
+Folds the current peak RSS into the peaks of the open phases.
+'''
+def fold_peak_rss():
+    peak = peak_rss_mb()
+    _open_phase_peaks[:] = [ max( open_peak, peak ) 
+        for open_peak in _open_phase_peaks ]
+
+def cpu_time():
+    usage = resource.getrusage( resource.RUSAGE_SELF )
+    return usage.ru_utime + usage.ru_stime
+
+'''
+Returns the seconds since the start of the process, or None where /proc
+is not available.
+'''
+def process_age():
+    try:
+        with open( '/proc/self/stat', 'r' ) as stat:
+            # Fields after the command name, starttime is field 22.
+            fields = stat.read().rsplit( ')', 1 )[1].split()
+        with open( '/proc/uptime', 'r' ) as uptime:
+            uptime_seconds = float( uptime.read().split()[0] )
+        return uptime_seconds - float( fields[19] ) / os.sysconf( 'SC_CLK_TCK' )
+    except ( IOError, OSError, ValueError, IndexError ):
+        return None
+
+'''
+Returns the record of the startup phase of the process up to now, or None
+if its start time is not known.
+'''
+def startup_phase():
+    age = process_age()
+    if age is None:
+        return None
+    return { 'wall': max( age, 0.0 ), 'cpu': cpu_time(), 
+        'peak_rss_mb': peak_rss_mb() }
+
+'''
+Records the phase into the profile, if given.
+'''
+@contextmanager
+def phase( profile, name ):
+    if profile is None:
+        yield
+        return
+
+    reset_peak_rss()
+    _open_phase_peaks.append( 0.0 )
+    start_wall, start_cpu = time.time(), cpu_time()
+    try:
+        yield
+    finally:
+        fold_peak_rss()
+        record = profile[ 'phases' ].setdefault( name,
+            { 'wall': 0.0, 'cpu': 0.0, 'peak_rss_mb': 0.0 } )
+        record[ 'wall' ] += time.time() - start_wall
+        record[ 'cpu' ] += cpu_time() - start_cpu
+        record[ 'peak_rss_mb' ] = max( record[ 'peak_rss_mb' ], 
+            _open_phase_peaks.pop() )
+
+'''
+Runs function() under cProfile if filename is given, dumping the stats
+into it. Returns the result of function().
+'''
+def run_profiled( function, filename = None ):
+    if filename is None:
+        return function()
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall( function )
+    finally:
+        profiler.dump_stats( filename )
+
+'''
+Profiles are stored in job results as JSON strings.
+'''
+def dumps( profile ):
+    return json.dumps( profile, sort_keys = True )
+
+def format_phases( profile ):
+    return '\n'.join( '  {name:24} wall {wall:9.3f} s  cpu {cpu:9.3f} s  '
+        'peak RSS {peak_rss_mb:8.1f} MB'.format( name = name, **record )
+        for name, record in sorted( profile[ 'phases' ].items(),
+        key = lambda item: -item[1][ 'wall' ] ) )
+
+'''
+Returns the report on the profiles of the jobs of the experiment
+(dict jobnumber -> profile): wall and CPU time per engine and other
+phases summed over the jobs, and the slowest gammas.
+'''
+def sweep_summary( experiment, job_profiles ):
+    if not job_profiles:
+        return 'No job profiles recorded'
+
+    totals = new_profile()
+    for profile in job_profiles.values():
+        for name, record in profile[ 'phases' ].items():
+            total = totals[ 'phases' ].setdefault( name,
+                { 'wall': 0.0, 'cpu': 0.0, 'peak_rss_mb': 0.0 } )
+            total[ 'wall' ] += record[ 'wall' ]
+            total[ 'cpu' ] += record[ 'cpu' ]
+            total[ 'peak_rss_mb' ] = max( total[ 'peak_rss_mb' ],
+                record[ 'peak_rss_mb' ] )
+
+    engines = [ getattr( experiment, 'mi_computing_type', None ),
+        getattr( experiment, 'error_computing_type', None ) ]
+    def job_time( k ):
+        return sum( job_profiles[k][ 'phases' ].get( engine, { 'wall': 0.0 } )
+            [ 'wall' ] for engine in engines )
+    slowest_jobs = sorted( job_profiles, key = job_time,
+        reverse = True )[ :summary_slowest ]
+
+    lines = [ 'Profile of {jobs} jobs (totals, peak RSS is the maximum):'.format(
+        jobs = len( job_profiles ) ), format_phases( totals ),
+        'Slowest gammas (engine wall time):' ]
+    lines += [ '  gamma {gamma:6}  {time:9.3f} s  ({phases})'.format(
+        gamma = experiment.job_gammas[ int( k ) ], time = job_time( k ),
+        phases = ', '.join( '{engine} {wall:.3f} s'.format( engine = engine,
+        wall = job_profiles[k][ 'phases' ][ engine ][ 'wall' ] )
+        for engine in engines if engine in job_profiles[k][ 'phases' ] ) )
+        for k in slowest_jobs ]
+
+    return '\n'.join( lines )
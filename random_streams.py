@@ -0,0 +1,44 @@
+import os
+import binascii
+import hashlib
+import numpy as np
+
+'''
+Reproducible random streams of the sampling engines.
+
+Every experiment has a seed (experiment.seed, saved with its setting), 
+every batch of draws of an engine gets its own stream, derived from the 
+seed and the spawn key ( engine, gamma, first draw of the batch ). Hence
+the draws of a job depend neither on which process or worker runs it nor
+on the other jobs, and batches can be drawn in any order or in parallel.
+
+This numpy has no SeedSequence / Generator, so a stream is a 
+np.random.RandomState initialized with the SHA-256 hash of (seed, spawn 
+key), which serves the same purpose: equal keys give the same stream, 
+distinct keys independent ones.
+'''
+
+'''
+Returns a fresh random seed for a new experiment.
+'''
+def new_seed():
+	return int( binascii.hexlify( os.urandom( 8 ) ), 16 ) >> 1
+
+'''
+Returns the stream of seed and spawn_key (a tuple of ints and strings).
+'''
+def stream( seed, *spawn_key ):
+	key = repr( ( int( seed ), ) + tuple( spawn_key ) ).encode( 'utf-8' )
+	return np.random.RandomState( np.frombuffer( hashlib.sha256( key ).digest(), 
+		dtype = np.uint32 ) )
+
+'''
+Returns the stream of the batch of draws of engine (its name) for gamma
+starting at draw batch_begin. Experiments saved without a seed use the
+global np.random, as before.
+'''
+def batch_stream( experiment, engine, gamma, batch_begin ):
+	seed = getattr( experiment, 'seed', None )
+	if seed is None:
+		return np.random
+	return stream( seed, engine, int( gamma ), int( batch_begin ) )
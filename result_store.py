@@ -0,0 +1,341 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import scipy.sparse
+
+from common_defs import *
+
+'''
+Storage of the results without pickled objects.
+
+The final result of an experiment is
+	<name>_final_p_joint.npy    p_joint of all gammas, shape (G, N, N),
+	                             preallocated and filled in per gamma as a
+	                             memory-mapped array
+	<name>_final.json           sidecar with the setting and the per-gamma
+	                             curves (MI, entropies, error)
+so that readers can memory-map p_joint and slice one gamma without 
+loading the rest. One job result is a <name>_jobresult_<k>.npz archive.
+
+Experiments with a banded p_joint (experiment.p_joint_band = h, see the
+p_joint_bandwidth of the engines) store only the band: p_joint_final has 
+shape (G, N, 2h + 1) with p_joint_final[k, i, d] = p_joint[i, i - h + d]. 
+Use p_joint_matrix to get the N x N matrix of one gamma. Sparse job 
+results are stored in the .npz as their CSR arrays.
+
+The final result is filled in incrementally: every merged job result is 
+copied into its slot and recorded (with its checksum) in 'merged_jobs' 
+of the sidecar, curves of jobs not merged yet are NaN. Hence partial 
+curves can be read while the sweep is still running.
+
+The profiles of the jobs (see profiling), stored in the job results as
+'job_profile', are kept in 'job_profiles' of the sidecar.
+
+Results saved before this format are <name>_final.pk pickles; 
+load_final_result still reads them, migrate_experiment converts them.
+'''
+
+# Per-gamma curves of the final result, p_joint_final is stored separately.
+final_curves = [ 'mutual_inf_final', 'h_joint_final', 'h_single_final',
+    'mean_err_final', 'std_err_final', 'mi_draws_final', 'mi_ci_final',
+    'err_draws_final', 'err_ci_final' ]
+
+# Curves of the sampling records (see adaptive_sampling) and their job 
+#  result fields, missing in older job results.
+sampling_curves = [ ( 'mi_draws_final', 'job_mi_draws' ), 
+    ( 'mi_ci_final', 'job_mi_ci' ), ( 'err_draws_final', 'job_err_draws' ), 
+    ( 'err_ci_final', 'job_err_ci' ) ]
+
+# Recorded in merged_jobs for results converted from legacy pickles.
+migrated_checksum = 'migrated'
+
+# Suffixes of the .npz entries of a sparse array of a job result.
+sparse_suffixes = [ '__sparse_data', '__sparse_indices', '__sparse_indptr', 
+    '__sparse_shape' ]
+
+# Setting attributes copied into the sidecar.
+sidecar_setting = [ 'name', 'number_solutions', 'noise_model', 
+    'gamma_val_low', 'gamma_val_high', 'gamma_val_step', 
+    'repetitions_for_error', 'repetitions_for_mi', 'mi_computing_type', 
+    'error_computing_type', 'p_joint_band', 'tolerance_for_error', 
+    'tolerance_for_mi', 'seed' ]
+
+def final_p_joint_filename( dir_name, name ):
+    return os.path.join( dir_name, name + '_' + experiment_finalresult_filename 
+        + '_p_joint' + os.extsep + numpy_array_suffix )
+
+def final_sidecar_filename( dir_name, name ):
+    return os.path.join( dir_name, name + '_' + experiment_finalresult_filename 
+        + os.extsep + json_suffix )
+
+def jobresult_filename( dir_name, name, jobnumber ):
+    return os.path.join( dir_name, name + '_' + experiment_jobresult_filename 
+        + '_' + str( jobnumber ) + os.extsep + numpy_archive_suffix )
+
+def legacy_final_filename( dir_name, name ):
+    return os.path.join( dir_name, name + '_' + experiment_finalresult_filename 
+        + os.extsep + pickle_suffix )
+
+def file_checksum( filename ):
+    checksum = hashlib.sha1()
+    with open( filename, 'rb' ) as input:
+        for block in iter( lambda: input.read( 2**20 ), b'' ):
+            checksum.update( block )
+    return checksum.hexdigest()
+
+'''
+Allocates the final result of the experiment: p_joint_final is a 
+memory-mapped array on disk, the curves are NaN in memory.
+'''
+def create_final_result( dir_name, experiment ):
+    number_gammas = len( experiment.job_gammas )
+    p_joint_band = getattr( experiment, 'p_joint_band', None )
+    if p_joint_band is None:
+        columns = experiment.number_solutions
+    else:
+        columns = 2 * p_joint_band + 1
+
+    final_result = CustomObj()
+    final_result.p_joint_final = np.lib.format.open_memmap( 
+        final_p_joint_filename( dir_name, experiment.name ), mode = 'w+', 
+        dtype = np.float64, shape = ( number_gammas, 
+        experiment.number_solutions, columns ) )
+    final_result.p_joint_band = p_joint_band
+    for curve in final_curves:
+        setattr( final_result, curve, np.nan * np.zeros( number_gammas ) )
+    final_result.merged_jobs = {}
+    final_result.job_profiles = {}
+
+    return final_result
+
+'''
+Opens the final result of the experiment for further merging, if it 
+exists and matches the setting, otherwise allocates a new one.
+'''
+def open_final_result( dir_name, experiment ):
+    sidecar_filename = final_sidecar_filename( dir_name, experiment.name )
+    if os.path.exists( sidecar_filename ):
+        with open( sidecar_filename, 'r' ) as input:
+            sidecar = json.load( input )
+        if ( sidecar[ 'job_gammas' ] == [ int( gamma ) for gamma in experiment.job_gammas ]
+                and sidecar[ 'number_solutions' ] == experiment.number_solutions 
+                and sidecar.get( 'p_joint_band' ) == getattr( experiment, 
+                    'p_joint_band', None ) ):
+            return load_final_result( dir_name, experiment.name, mmap_mode = 'r+' )
+
+    return create_final_result( dir_name, experiment )
+
+'''
+Copies the result of job k into its slot of the final result.
+'''
+def store_onejob_result( final_result, k, onejob_result, checksum = None ):
+    final_result.mutual_inf_final[k] = onejob_result.job_mutual_inf
+    p_joint_band = getattr( final_result, 'p_joint_band', None )
+    if p_joint_band is None:
+        p_joint = onejob_result.job_p_joint
+        if scipy.sparse.issparse( p_joint ):
+            p_joint = p_joint.toarray()
+        final_result.p_joint_final[k] = p_joint
+    else:
+        p_entries = scipy.sparse.coo_matrix( onejob_result.job_p_joint )
+        offsets = p_entries.col - p_entries.row + p_joint_band
+        if np.any( ( offsets < 0 ) | ( offsets > 2 * p_joint_band ) ):
+            raise ValueError( 'p_joint of job {k} exceeds band {band}'.format( 
+                k = k, band = p_joint_band ) )
+        final_result.p_joint_final[k] = 0.0
+        final_result.p_joint_final[ k, p_entries.row, offsets ] = p_entries.data
+    final_result.h_joint_final[k] = onejob_result.job_h_joint
+    final_result.h_single_final[k] = onejob_result.job_h_single
+    final_result.mean_err_final[k] = onejob_result.job_mean_err
+    final_result.std_err_final[k] = onejob_result.job_std_err
+    for curve, field in sampling_curves:
+        getattr( final_result, curve )[k] = getattr( onejob_result, field, np.nan )
+    if hasattr( onejob_result, 'job_profile' ):
+        final_result.job_profiles[ str( k ) ] = json.loads( 
+            onejob_result.job_profile )
+    final_result.merged_jobs[ str( k ) ] = checksum
+
+'''
+Merges job result k into the final result, if its file matches the 
+checksum its manifest entry records on completion (None while the job is 
+not done) and it was not merged yet in this version. The p_joint is 
+copied straight into its slot on disk and dropped. Returns whether it was 
+merged.
+'''
+def merge_jobresult( dir_name, experiment, final_result, k, done_checksum ):
+    filename = jobresult_filename( dir_name, experiment.name, k )
+    if done_checksum is None or not os.path.exists( filename ):
+        return False
+
+    checksum = file_checksum( filename )
+    if checksum != done_checksum:
+        return False
+    if str( k ) in final_result.merged_jobs and \
+            final_result.merged_jobs[ str( k ) ] in ( checksum, migrated_checksum ):
+        return False
+
+    store_onejob_result( final_result, k, load_onejob_result( filename ), checksum )
+    return True
+
+'''
+Merges all new job results of done jobs, done_checksums being the 
+checksums of the done jobs by jobnumber (see job_manifest.done_checksums).
+Returns the list of merged jobnumbers.
+'''
+def merge_jobresults( dir_name, experiment, final_result, done_checksums ):
+    return [ k for k in range( len( experiment.job_gammas ) ) 
+        if merge_jobresult( dir_name, experiment, final_result, k, 
+        done_checksums.get( k ) ) ]
+
+'''
+Returns the jobnumbers not merged into the final result yet.
+'''
+def unmerged_jobs( experiment, final_result ):
+    return [ k for k in range( len( experiment.job_gammas ) ) 
+        if str( k ) not in final_result.merged_jobs ]
+
+'''
+Flushes p_joint_final and writes the sidecar. Returns the written files.
+'''
+def save_final_result( dir_name, experiment, final_result ):
+    final_result.p_joint_final.flush()
+
+    sidecar = dict( ( key, getattr( experiment, key, None ) ) 
+        for key in sidecar_setting )
+    sidecar[ 'job_gammas' ] = [ int( gamma ) for gamma in experiment.job_gammas ]
+    sidecar[ 'p_joint_file' ] = os.path.basename( 
+        final_p_joint_filename( dir_name, experiment.name ) )
+    for curve in final_curves:
+        sidecar[ curve ] = [ float( value ) for value in getattr( final_result, curve ) ]
+    sidecar[ 'merged_jobs' ] = final_result.merged_jobs
+    sidecar[ 'job_profiles' ] = getattr( final_result, 'job_profiles', {} )
+
+    sidecar_filename = final_sidecar_filename( dir_name, experiment.name )
+    with open( sidecar_filename + '.tmp', 'w' ) as output:
+        json.dump( sidecar, output, indent = 1, sort_keys = True )
+    os.rename( sidecar_filename + '.tmp', sidecar_filename )
+
+    return [ final_p_joint_filename( dir_name, experiment.name ), sidecar_filename ]
+
+'''
+Loads the final result. p_joint_final is memory-mapped with mmap_mode 
+(None loads it whole). Falls back to the legacy pickle.
+'''
+def load_final_result( dir_name, name, mmap_mode = 'r' ):
+    sidecar_filename = final_sidecar_filename( dir_name, name )
+    if not os.path.exists( sidecar_filename ):
+        with open( legacy_final_filename( dir_name, name ), 'rb' ) as input:
+            return pickle.load( input )
+
+    with open( sidecar_filename, 'r' ) as input:
+        sidecar = json.load( input )
+
+    final_result = CustomObj()
+    for curve in final_curves:
+        setattr( final_result, curve, np.array( sidecar.get( curve, 
+            [ np.nan ] * len( sidecar[ 'job_gammas' ] ) ), dtype = float ) )
+    final_result.p_joint_final = np.load( os.path.join( dir_name, 
+        sidecar[ 'p_joint_file' ] ), mmap_mode = mmap_mode )
+    final_result.merged_jobs = sidecar.get( 'merged_jobs', {} )
+    final_result.job_profiles = sidecar.get( 'job_profiles', {} )
+    final_result.p_joint_band = sidecar.get( 'p_joint_band' )
+
+    return final_result
+
+'''
+Returns p_joint of job k of the final result as an N x N array, expanding
+the band if p_joint is stored banded.
+'''
+def p_joint_matrix( final_result, k ):
+    p_joint_band = getattr( final_result, 'p_joint_band', None )
+    if p_joint_band is None:
+        return np.asarray( final_result.p_joint_final[k] )
+
+    band = np.asarray( final_result.p_joint_final[k] )
+    number_solutions = band.shape[0]
+    rows = np.arange( number_solutions )[ :, np.newaxis ]
+    cols = rows - p_joint_band + np.arange( band.shape[1] )[ np.newaxis, : ]
+    inside = ( cols >= 0 ) & ( cols < number_solutions )
+
+    p_joint = np.zeros( ( number_solutions, number_solutions ) )
+    p_joint[ np.broadcast_to( rows, cols.shape )[ inside ], cols[ inside ] ] = \
+        band[ inside ]
+    return p_joint
+
+'''
+Saves one job result (a CustomObj of scalars, arrays and scipy.sparse 
+matrices) as .npz.
+'''
+def save_onejob_result( filename, onejob_result ):
+    arrays = {}
+    for key, value in vars( onejob_result ).items():
+        if scipy.sparse.issparse( value ):
+            value = value.tocsr()
+            for suffix, array in zip( sparse_suffixes, ( value.data, 
+                    value.indices, value.indptr, np.array( value.shape ) ) ):
+                arrays[ key + suffix ] = array
+        else:
+            arrays[ key ] = value
+
+    # Written under a temporary name first, so that the file is never seen 
+    #  half written, by a merge or after a preempted job.
+    with open( filename + '.tmp', 'wb' ) as output:
+        np.savez( output, **arrays )
+    os.rename( filename + '.tmp', filename )
+
+def load_onejob_result( filename ):
+    onejob_result = CustomObj()
+    archive = np.load( filename )
+    try:
+        for key in archive.files:
+            if key.endswith( sparse_suffixes[0] ):
+                key = key[ :-len( sparse_suffixes[0] ) ]
+                data, indices, indptr, shape = [ archive[ key + suffix ] 
+                    for suffix in sparse_suffixes ]
+                setattr( onejob_result, key, scipy.sparse.csr_matrix( 
+                    ( data, indices, indptr ), shape = tuple( shape ) ) )
+            elif not any( key.endswith( suffix ) for suffix in sparse_suffixes ):
+                value = archive[ key ]
+                setattr( onejob_result, key, value.item() if value.ndim == 0 else value )
+    finally:
+        archive.close()
+
+    return onejob_result
+
+'''
+Converts pickled results of the experiment (final result and job 
+results) into the current format. The pickles are kept. Returns the 
+written files.
+'''
+def migrate_experiment( dir_name, experiment ):
+    written = []
+
+    legacy_filename = legacy_final_filename( dir_name, experiment.name )
+    if os.path.exists( legacy_filename ):
+        with open( legacy_filename, 'rb' ) as input:
+            legacy_result = pickle.load( input )
+
+        final_result = create_final_result( dir_name, experiment )
+        final_result.p_joint_final[:] = legacy_result.p_joint_final
+        for curve in final_curves:
+            # Older experiments did not compute the error.
+            setattr( final_result, curve, np.array( getattr( legacy_result, curve, 
+                np.nan * np.zeros( len( experiment.job_gammas ) ) ), dtype = float ) )
+        final_result.merged_jobs = dict( ( str( k ), migrated_checksum ) 
+            for k in range( len( experiment.job_gammas ) ) )
+        written += save_final_result( dir_name, experiment, final_result )
+
+    for k in range( len( experiment.job_gammas ) ):
+        legacy_filename = os.path.join( dir_name, experiment.name + '_' 
+            + experiment_jobresult_filename + '_' + str( k ) + os.extsep 
+            + pickle_suffix )
+        if os.path.exists( legacy_filename ):
+            with open( legacy_filename, 'rb' ) as input:
+                onejob_result = pickle.load( input )
+            filename = jobresult_filename( dir_name, experiment.name, k )
+            save_onejob_result( filename, onejob_result )
+            written.append( filename )
+
+    return written
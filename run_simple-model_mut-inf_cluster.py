@@ -1,21 +1,22 @@
-import scipy.stats as sp
 import numpy as np
 import sys
-from collections import defaultdict
-from matplotlib import pyplot as plt
-from matplotlib import rc
 import argparse as ap
 import os
 from subprocess import call
 import pickle
+import hashlib
+import time
+import traceback
 
 from common_defs import *
-import mi_computing_1
-import mi_computing_2
-import mi_computing_3
-import mi_computing_4
-import error_computing_1
-import plot_functions
+import engines
+import noise_models
+import adaptive_sampling
+import random_streams
+import job_manifest
+import job_schedulers
+import result_store
+import profiling
 
 """
 The script is intended for Brutus usage. 
@@ -31,43 +32,88 @@ With the parameter '--dispatch':
     --number_solutions
     --repetitions_for_error
     --repetitions_for_mi
-    --mi_computing_type  (see mi_computing_modules)
-
-    Creates subfolder for experiment and puts experiment.pk with the necessary info
+    --tolerance_for_error, --tolerance_for_mi  (optional, the sampling
+        engines then stop once the confidence interval of the estimate is
+        within the tolerance, the repetitions being the maximum, see
+        adaptive_sampling)
+    --seed  (optional, saved with the setting, see random_streams; a new
+        random one by default)
+    --mi_computing_type  (see engines.mi_computing_modules)
+    --scheduler  (optional, see schedulers, defaults to 'local')
+    --workers  (optional, number of local worker processes, defaults to
+        the number of cores)
+    --resume  (optional, only --name is needed then: keeps the saved setting
+        and dispatches only the jobs which are missing or failed according 
+        to the manifest)
+    --resume_pending  (optional, with --resume also dispatches the jobs 
+        which are still queued or running according to the manifest, i.e.
+        lost by the scheduler)
+
+    Creates subfolder for experiment and puts experiment.pk with the necessary info,
+    then dispatches all the jobs with the scheduler. The 'local' one runs them
+    in a local process pool and finalizes the results if all of them succeeded,
+    'lsf' and 'slurm' submit one job array, 'dry-run' only writes the job 
+    array scripts
+
+With parameter '--sweep':
+    Same subparameters as '--dispatch'
+
+    Computes all gammas in one process, sharing the noise kernel and other
+    gamma-independent precomputations, and writes the final result directly
+    (no --onejob / --finalize needed)
 
 With parameter '--onejob':
     --name
-    --jobnumber
+    --jobnumber  (taken from the scheduler environment for array jobs)
+    --cprofile  (optional, also with --dispatch: dumps cProfile stats of 
+        the job into <name>_cprofile_<jobnumber>.prof)
 
-    Runs one separate job with given 'jobnumber'
+    Runs one separate job with given 'jobnumber'. Wall time, CPU time and 
+    peak RSS of its phases and engine calls, and its startup time, are 
+    printed and stored with the job result and in the manifest, see 
+    profiling. Only numpy, scipy and the engines of the experiment are 
+    imported, matplotlib only with --plot
 
 With parameter '--finalize':
     --name
     --gitcommit
-    Aggregates all the necessary information into results.pk
+    --watch  (optional, keep merging job results as they appear, until all 
+        of them are merged or the remaining ones have failed)
+    --watch_interval  (optional, seconds between checks, defaults to 10)
+    Merges all new job results into the final result (see result_store),
+    one at a time, so partial curves are available already. If some job
+    results are absent, reports their gammas and fails instead. Prints the
+    summary of the job profiles: time per engine, slowest gammas
+
+With '--migrate'
+    --name
+    Converts pickled final and job results of the experiment into the 
+    current format, see result_store
 
 With '--plot'
     --name
     --gitcommit
-    Plots everything into figures/...eps
+    --plot_workers  (optional, processes plotting the p_joint heatmaps, 
+        defaults to the number of cores)
+    --p_joint_output  (optional, 'files' (default): one heatmap per gamma, 
+        'multipage': one PDF, 'tiled': one figure of all gammas)
+    --replot  (optional, also replot the heatmaps of unchanged gammas)
+    Plots everything into figures/...eps. Heatmaps of gammas whose p_joint
+    has not changed since they were plotted are kept
 
 
 So the pipline: first --dispatch (this will create necessary amount of
 --onejob jobs), then --finalize
-"""
 
-mi_computing_modules = {
-    "mi_computing_1": mi_computing_1,
-    "mi_computing_2": mi_computing_2,
-    "mi_computing_3": mi_computing_3,
-    "mi_computing_4": mi_computing_4,
-}
+Every --onejob records its status, timing and result checksum in the
+experiment manifest, see job_manifest
 
-error_computing_modules = {
-    "error_computing_1": error_computing_1,
-}
+With any mode:
+    --kernel_cache_dir  (optional, directory of the noise kernels cached 
+        on disk, defaults to data/kernels, shared between experiments)
+"""
 
-def dispatch_jobs( dir_name, args ):
+def save_experiment_setting( dir_name, args ):
     pickle_filename = os.path.join( dir_name, args.name + '_' 
         + experiment_setting_filename + os.extsep + pickle_suffix )
 
@@ -81,121 +127,416 @@ def dispatch_jobs( dir_name, args ):
         experiment.noise_model = args.noise_model
         experiment.repetitions_for_error = args.repetitions_for_error
         experiment.repetitions_for_mi = args.repetitions_for_mi
+        experiment.tolerance_for_error = args.tolerance_for_error
+        experiment.tolerance_for_mi = args.tolerance_for_mi
+        experiment.seed = args.seed
+        if experiment.seed is None:
+            experiment.seed = random_streams.new_seed()
         experiment.mi_computing_type = args.mi_computing_type
         experiment.error_computing_type = args.error_computing_type
         experiment.job_gammas = np.arange( args.gamma_val_low, args.gamma_val_high, 
             args.gamma_val_step )
+        experiment.p_joint_band = p_joint_band( experiment )
 
         # Saving a file with the experiment setting
         pickle.dump( experiment, output )
 
-    # # Dispatching
-    # for k in range( len( experiment.job_gammas ) ):
-    #     call( ['bsub', '-W', '08:00', '-R', 'rusage[mem=2048]',
-    #         'python', 'run_simple-model_mut-inf_cluster.py',
-    #         '--onejob', '--jobnumber', str( k ),
-    #         '--name', args.name ] )
-
-    # For non-cluster debug purposes
-    for k in range( len( experiment.job_gammas ) ):
-        call( [ 'python', 'run_simple-model_mut-inf_cluster.py',
-            '--onejob', '--jobnumber', str( k ),
-            '--name', args.name ] )
-
-def process_onejob( dir_name, args ):
-    # Open experiment setting
-    pickle_filename = os.path.join( dir_name, args.name + '_' 
+    return experiment
+
+'''
+Returns the half bandwidth of the band p_joint of all gammas fits in, if 
+the mi engine computes it sparse for all of them (see p_joint_bandwidth 
+of the engines), otherwise None. The final result stores only this band.
+'''
+def p_joint_band( experiment ):
+    mi_comp_module = engines.mi_computing_module( experiment.mi_computing_type )
+    if not hasattr( mi_comp_module, 'p_joint_bandwidth' ):
+        return None
+
+    bands = [ mi_comp_module.p_joint_bandwidth( gamma, experiment ) 
+        for gamma in experiment.job_gammas ]
+    if not bands or None in bands:
+        return None
+    return int( max( bands ) )
+
+def load_experiment_setting( dir_name, name ):
+    pickle_filename = os.path.join( dir_name, name + '_' 
         + experiment_setting_filename + os.extsep + pickle_suffix )
     with open( pickle_filename, 'rb') as input:
-        experiment = pickle.load( input )
-    
-    gamma = experiment.job_gammas[ args.jobnumber ]
-    mi_comp_module = mi_computing_modules[ experiment.mi_computing_type ]
-    
-    [mutual_inf, p_joint, h_joint, h_single] = \
-        mi_comp_module.compute_mutual_inf( gamma, experiment )
+        return pickle.load( input )
 
-    error_computing_module = error_computing_modules[ experiment.error_computing_type ]
-    
-    [mutual_inf, p_joint, h_joint, h_single] = \
-        mi_comp_module.compute_mutual_inf( gamma, experiment )
-    
-    mean_err, std_err = error_computing_module.compute_error( gamma,
-        experiment )
+'''
+Removes the job results of a previous dispatch, which must not be merged 
+into the final result of a new dispatch or sweep.
+'''
+def remove_jobresults( dir_name, experiment ):
+    for k in range( len( experiment.job_gammas ) ):
+        filename = result_store.jobresult_filename( dir_name, experiment.name, k )
+        if os.path.exists( filename ):
+            os.remove( filename )
 
-    pickle_filename = os.path.join( dir_name, args.name + '_' 
-        + experiment_jobresult_filename + '_' + str( args.jobnumber ) + os.extsep 
-        + pickle_suffix )
-    with open( pickle_filename, 'wb' ) as output:
-        onejob_result = CustomObj()
-        onejob_result.jobnumber = args.jobnumber
-        onejob_result.job_mean_err = mean_err
-        onejob_result.job_std_err = std_err
-        onejob_result.job_mutual_inf = mutual_inf
-        onejob_result.job_p_joint = p_joint
-        onejob_result.job_h_joint = h_joint
-        onejob_result.job_h_single = h_single
-        
-        # Saving a file.
-        pickle.dump( onejob_result, output )
+def dispatch_jobs( dir_name, args ):
+    if args.resume:
+        experiment = load_experiment_setting( dir_name, args.name )
+        jobnumbers = job_manifest.incomplete_jobs( dir_name, experiment, 
+            include_pending = args.resume_pending )
+        print( 'Resuming jobs: {jobs}'.format( 
+            jobs = ' '.join( map( str, jobnumbers ) ) or 'none' ) )
+    else:
+        experiment = save_experiment_setting( dir_name, args )
+        jobnumbers = range( len( experiment.job_gammas ) )
+
+        remove_jobresults( dir_name, experiment )
+        result_store.save_final_result( dir_name, experiment, 
+            result_store.create_final_result( dir_name, experiment ) )
+
+    for k in jobnumbers:
+        job_manifest.update_job( dir_name, args.name, k, 
+            gamma = int( experiment.job_gammas[k] ), 
+            status = job_manifest.status_queued, scheduler = args.scheduler )
+
+    failed_jobs = []
+    if jobnumbers:
+        failed_jobs = schedulers[ args.scheduler ]( dir_name, args, experiment, 
+            jobnumbers )
+
+    # Only the local scheduler has all the jobs completed here.
+    if args.scheduler != 'local':
+        return
+
+    if failed_jobs:
+        print( 'Not finalizing, failed jobs: {jobs}'.format( 
+            jobs = ' '.join( map( str, failed_jobs ) ) ) )
+    else:
+        finalize_results( dir_name, args )
 
-def finalize_results( dir_name, args ):
-    # Open experiment setting
-    pickle_filename = os.path.join( dir_name, args.name + '_' 
-        + experiment_setting_filename + os.extsep + pickle_suffix )
-    with open( pickle_filename, 'rb') as input:
-        experiment = pickle.load( input )
+'''
+Runs one job inside a pool worker. Returns (jobnumber, wall time, error), 
+error being None or the formatted traceback.
+'''
+def onejob_worker( job ):
+    dir_name, name, jobnumber, cprofile = job
+    start_time = time.time()
+    try:
+        process_onejob( dir_name, ap.Namespace( name = name, jobnumber = jobnumber, 
+            cprofile = cprofile ) )
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+
+    return jobnumber, time.time() - start_time, error
+
+'''
+Runs the given jobs of the experiment in a local pool of worker processes,
+reporting each one as it completes and merging its result into the final 
+result. Returns the list of failed jobnumbers.
+'''
+def run_jobs_in_pool( dir_name, args, experiment, jobnumbers ):
+    import multiprocessing
+    workers = args.workers or multiprocessing.cpu_count()
+    jobs = [ ( dir_name, args.name, k, args.cprofile ) for k in jobnumbers ]
+    final_result = result_store.open_final_result( dir_name, experiment )
+
+    failed_jobs = []
+    pool = multiprocessing.Pool( processes = workers )
+    try:
+        for jobnumber, wall_time, error in pool.imap_unordered( onejob_worker, jobs ):
+            if error is None:
+                print( 'Job {k} (gamma {gamma}) done in {time:.2f} s'.format( 
+                    k = jobnumber, gamma = experiment.job_gammas[ jobnumber ], 
+                    time = wall_time ) )
+                if result_store.merge_jobresult( dir_name, experiment, 
+                        final_result, jobnumber, job_manifest.done_checksums( 
+                        dir_name, args.name ).get( jobnumber ) ):
+                    result_store.save_final_result( dir_name, experiment, 
+                        final_result )
+            else:
+                failed_jobs.append( jobnumber )
+                print( 'Job {k} (gamma {gamma}) FAILED after {time:.2f} s\n{error}'.format( 
+                    k = jobnumber, gamma = experiment.job_gammas[ jobnumber ], 
+                    time = wall_time, error = error ) )
+    finally:
+        pool.close()
+        pool.join()
+
+    return sorted( failed_jobs )
+
+schedulers = {
+    "local": run_jobs_in_pool,
+    "lsf": job_schedulers.submit_lsf,
+    "slurm": job_schedulers.submit_slurm,
+    "dry-run": job_schedulers.dry_run,
+}
 
+def process_onejob( dir_name, args ):
+    profile = profiling.new_profile()
+    # Startup of the --onejob process, pool workers have none.
+    if getattr( args, 'startup', None ) is not None:
+        profile[ 'phases' ][ 'startup' ] = args.startup
+    with profiling.phase( profile, 'load_setting' ):
+        experiment = load_experiment_setting( dir_name, args.name )
+
+    start_time = time.time()
+    job_manifest.update_job( dir_name, args.name, args.jobnumber, 
+        gamma = int( experiment.job_gammas[ args.jobnumber ] ), 
+        status = job_manifest.status_running, start_time = start_time, 
+        host = os.uname()[1] )
+    try:
+        with profiling.phase( profile, 'compute' ):
+            onejob_result = profiling.run_profiled( 
+                lambda: load_or_compute_onejob( dir_name, experiment, 
+                args.jobnumber, profile ), 
+                cprofile_filename( dir_name, args ) )
+        # The saving itself is recorded in the manifest only.
+        onejob_result.job_profile = profiling.dumps( profile )
+
+        jobresult_filename = result_store.jobresult_filename( dir_name, args.name, 
+            args.jobnumber )
+        with profiling.phase( profile, 'save_result' ):
+            result_store.save_onejob_result( jobresult_filename, onejob_result )
+    except Exception:
+        job_manifest.update_job( dir_name, args.name, args.jobnumber, 
+            status = job_manifest.status_failed, 
+            wall_time = time.time() - start_time, error = traceback.format_exc(),
+            profile = profile )
+        raise
+
+    job_manifest.update_job( dir_name, args.name, args.jobnumber, 
+        status = job_manifest.status_done, wall_time = time.time() - start_time,
+        checksum = result_store.file_checksum( jobresult_filename ), error = None,
+        profile = profile )
+    print( 'Job {k} (gamma {gamma}) profile:\n{phases}'.format( k = args.jobnumber, 
+        gamma = experiment.job_gammas[ args.jobnumber ], 
+        phases = profiling.format_phases( profile ) ) )
+
+'''
+Returns the filename for the cProfile stats of the job, if requested by 
+--cprofile, otherwise None.
+'''
+def cprofile_filename( dir_name, args ):
+    if not getattr( args, 'cprofile', False ):
+        return None
+    return os.path.join( dir_name, args.name + '_' + experiment_cprofile_filename 
+        + '_' + str( args.jobnumber ) + os.extsep + cprofile_suffix )
+
+'''
+Returns the filename of the cached result of one job. The cache is keyed
+by everything the result depends on, so that it is valid across reruns,
+resubmissions and repeated dispatches of the experiment: the draws, 
+tolerance, confidence level and seed only for engines which sample (see 
+sampling_key), as a dispatch without --seed draws a new seed.
+'''
+def job_cache_filename( dir_name, experiment, jobnumber ):
+    mi_comp_module = engines.mi_computing_module( experiment.mi_computing_type )
+    error_computing_module = engines.error_computing_module( 
+        experiment.error_computing_type )
+    cache_key = ( experiment.mi_computing_type, experiment.error_computing_type,
+        experiment.noise_model, int( experiment.number_solutions ), 
+        int( experiment.job_gammas[ jobnumber ] ),
+        sampling_key( mi_comp_module, experiment, experiment.repetitions_for_mi,
+        getattr( experiment, 'tolerance_for_mi', None ) ),
+        sampling_key( error_computing_module, experiment, 
+        experiment.repetitions_for_error, 
+        getattr( experiment, 'tolerance_for_error', None ) ) )
+    cache_hash = hashlib.sha1( repr( cache_key ).encode( 'utf-8' ) ).hexdigest()
+
+    return os.path.join( dir_name, experiment.name + '_' 
+        + experiment_jobcache_filename + '_' + cache_hash + os.extsep 
+        + numpy_archive_suffix )
+
+'''
+Part of the cache key for the engine module: what its result depends on 
+besides the gamma and the noise model, if it samples, otherwise None.
+'''
+def sampling_key( module, experiment, repetitions, tolerance ):
+    if not getattr( module, 'records_sampling', False ):
+        return None
+    return ( repetitions, tolerance, adaptive_sampling.confidence_level, 
+        getattr( experiment, 'seed', None ) )
+
+'''
+Same as compute_onejob, but reuses the cached result if there is one, and
+caches the result otherwise.
+'''
+def load_or_compute_onejob( dir_name, experiment, jobnumber, profile = None ):
+    cache_filename = job_cache_filename( dir_name, experiment, jobnumber )
+    if os.path.exists( cache_filename ):
+        with profiling.phase( profile, 'load_cache' ):
+            onejob_result = result_store.load_onejob_result( cache_filename )
+        onejob_result.jobnumber = jobnumber
+        return onejob_result
+
+    onejob_result = compute_onejob( experiment, jobnumber, profile )
+
+    with profiling.phase( profile, 'save_cache' ):
+        result_store.save_onejob_result( cache_filename, onejob_result )
+
+    return onejob_result
+
+'''
+Computes the result of one job. The engine calls are recorded into the 
+profile, if given, as phases named by the engines.
+'''
+def compute_onejob( experiment, jobnumber, profile = None ):
+    gamma = experiment.job_gammas[ jobnumber ]
+    mi_comp_module = engines.mi_computing_module( experiment.mi_computing_type )
+    error_computing_module = engines.error_computing_module( 
+        experiment.error_computing_type )
+
+    mi_sampling = analytic_sampling()
+    with profiling.phase( profile, experiment.mi_computing_type ):
+        [mutual_inf, p_joint, h_joint, h_single] = \
+            mi_comp_module.compute_mutual_inf( gamma, experiment, 
+            **sampling_arguments( mi_comp_module, mi_sampling ) )
+    
+    error_sampling = analytic_sampling()
+    with profiling.phase( profile, experiment.error_computing_type ):
+        mean_err, std_err = error_computing_module.compute_error( gamma,
+            experiment, **sampling_arguments( error_computing_module, 
+            error_sampling ) )
+
+    onejob_result = CustomObj()
+    onejob_result.jobnumber = jobnumber
+    onejob_result.job_mean_err = mean_err
+    onejob_result.job_std_err = std_err
+    onejob_result.job_mutual_inf = mutual_inf
+    onejob_result.job_p_joint = p_joint
+    onejob_result.job_h_joint = h_joint
+    onejob_result.job_h_single = h_single
+    onejob_result.job_mi_draws = mi_sampling.draws
+    onejob_result.job_mi_ci = mi_sampling.ci_halfwidth
+    onejob_result.job_err_draws = error_sampling.draws
+    onejob_result.job_err_ci = error_sampling.ci_halfwidth
+
+    return onejob_result
+
+'''
+Sampling record of engines which compute exactly: no draws, no interval.
+'''
+def analytic_sampling():
+    sampling = CustomObj()
+    adaptive_sampling.record( sampling, 0, 0.0 )
+    return sampling
+
+'''
+Keyword arguments passing the sampling record to the engine module, if 
+it records sampling (see adaptive_sampling).
+'''
+def sampling_arguments( module, sampling ):
+    if getattr( module, 'records_sampling', False ):
+        return { 'sampling': sampling }
+    return {}
+
+def sweep_jobs( dir_name, args ):
+    experiment = save_experiment_setting( dir_name, args )
+    remove_jobresults( dir_name, experiment )
+    final_result = result_store.create_final_result( dir_name, experiment )
+
+    # All gammas in this process: the engines cache the noise kernel and 
+    #  the gamma-independent prefix sums, so these are computed only once.
+    for k in range( len( experiment.job_gammas ) ):
+        profile = profiling.new_profile()
+        with profiling.phase( profile, 'compute' ):
+            onejob_result = load_or_compute_onejob( dir_name, experiment, k, 
+                profile )
+        onejob_result.job_profile = profiling.dumps( profile )
+        result_store.store_onejob_result( final_result, k, onejob_result )
+        result_store.save_final_result( dir_name, experiment, final_result )
+        # No job result file, hence no checksum, see job_manifest.
+        job_manifest.update_job( dir_name, args.name, k, 
+            gamma = int( experiment.job_gammas[k] ), 
+            status = job_manifest.status_done, scheduler = 'sweep', 
+            wall_time = profile[ 'phases' ][ 'compute' ][ 'wall' ], 
+            checksum = None, error = None, profile = profile )
+
+    save_final_result( dir_name, args, experiment, final_result )
+    print( profiling.sweep_summary( experiment, final_result.job_profiles ) )
+
+def save_final_result( dir_name, args, experiment, final_result ):
     # If need to add to git
     if args.gitcommit:
-        call( ['git', 'add', pickle_filename ] )
-
-    mutual_inf_final = np.zeros( len( experiment.job_gammas ) ) 
-    p_joint_final = np.zeros( ( len( experiment.job_gammas ), 
-        experiment.number_solutions, experiment.number_solutions ) ) 
-    h_joint_final = np.zeros( len( experiment.job_gammas ) ) 
-    h_single_final = np.zeros( len( experiment.job_gammas ) ) 
-    mean_err_final = np.zeros( len( experiment.job_gammas ) ) 
-    std_err_final = np.zeros( len( experiment.job_gammas ) ) 
-
-    for k in range( len( experiment.job_gammas ) ):
         pickle_filename = os.path.join( dir_name, args.name + '_' 
-            + experiment_jobresult_filename + '_' + str( k ) + os.extsep 
-            + pickle_suffix )
-        with open( pickle_filename, 'rb' ) as input:
-            onejob_result = pickle.load( input )
-            mutual_inf_final[k] = onejob_result.job_mutual_inf
-            p_joint_final[k] = onejob_result.job_p_joint
-            h_joint_final[k] = onejob_result.job_h_joint
-            h_single_final[k] = onejob_result.job_h_single
-            mean_err_final[k] = onejob_result.job_mean_err
-            std_err_final[k] = onejob_result.job_std_err
-
-    pickle_filename = os.path.join( dir_name, args.name + '_' 
-        + experiment_finalresult_filename + os.extsep + pickle_suffix )
-    with open( pickle_filename, 'wb' ) as output:
-        final_result = CustomObj()
-        final_result.mutual_inf_final = mutual_inf_final
-        final_result.p_joint_final = p_joint_final
-        final_result.h_joint_final = h_joint_final
-        final_result.h_single_final = h_single_final
-        final_result.mean_err_final = mean_err_final
-        final_result.std_err_final = std_err_final
+            + experiment_setting_filename + os.extsep + pickle_suffix )
+        call( ['git', 'add', pickle_filename ] )
 
-        # Saving a file with the final result.
-        pickle.dump( final_result, output )
+    # Saving the final result.
+    written_filenames = result_store.save_final_result( dir_name, experiment, 
+        final_result )
 
     if args.gitcommit:
-        call( ['git', 'add', pickle_filename ] )
+        call( ['git', 'add' ] + written_filenames )
         call( ['git', 'commit', '-m', '"Automatic commit"' ] )
         call( ['git', 'push' ] )
 
+def finalize_results( dir_name, args ):
+    profile = profiling.new_profile()
+    with profiling.phase( profile, 'load_setting' ):
+        experiment = load_experiment_setting( dir_name, args.name )
+
+    # p_joint of every job goes straight into its slot of the memory-mapped
+    #  final array, so only one job result is in memory at a time.
+    with profiling.phase( profile, 'open_final_result' ):
+        final_result = result_store.open_final_result( dir_name, experiment )
+
+    while True:
+        with profiling.phase( profile, 'merge' ):
+            merged_jobs = result_store.merge_jobresults( dir_name, experiment, 
+                final_result, job_manifest.done_checksums( dir_name, args.name ) )
+        absent_jobs = result_store.unmerged_jobs( experiment, final_result )
+        if merged_jobs:
+            with profiling.phase( profile, 'save_final_result' ):
+                result_store.save_final_result( dir_name, experiment, final_result )
+            print( 'Merged jobs {jobs}, {merged}/{total} merged'.format( 
+                jobs = ' '.join( map( str, merged_jobs ) ), 
+                merged = len( experiment.job_gammas ) - len( absent_jobs ),
+                total = len( experiment.job_gammas ) ) )
+
+        if not absent_jobs or not args.watch:
+            break
+
+        # Nothing to wait for, if all the remaining jobs have failed.
+        manifest = job_manifest.load_manifest( dir_name, args.name )
+        if all( manifest[ 'jobs' ].get( str( k ), {} ).get( 'status' ) 
+                == job_manifest.status_failed for k in absent_jobs ):
+            break
+
+        time.sleep( args.watch_interval )
+
+    if absent_jobs:
+        sys.exit( 'Cannot finalize, results are absent for gammas: {gammas} '
+            '(jobs: {jobs}); use --dispatch --resume'.format( 
+            gammas = ' '.join( str( experiment.job_gammas[k] ) for k in absent_jobs ),
+            jobs = ' '.join( map( str, absent_jobs ) ) ) )
+
+    with profiling.phase( profile, 'save_final_result' ):
+        save_final_result( dir_name, args, experiment, final_result )
+
+    print( profiling.sweep_summary( experiment, final_result.job_profiles ) )
+    print( 'Finalize profile:\n' + profiling.format_phases( profile ) )
+
+def migrate_results( dir_name, args ):
+    experiment = load_experiment_setting( dir_name, args.name )
+    for filename in result_store.migrate_experiment( dir_name, experiment ):
+        print( 'Written ' + filename )
+
+    # Migrated job results are done jobs, only those are merged.
+    for k in range( len( experiment.job_gammas ) ):
+        filename = result_store.jobresult_filename( dir_name, args.name, k )
+        if os.path.exists( filename ):
+            job_manifest.update_job( dir_name, args.name, k, 
+                gamma = int( experiment.job_gammas[k] ), 
+                status = job_manifest.status_done, 
+                checksum = result_store.file_checksum( filename ), error = None )
+
 # main script file
 if __name__ == "__main__":
 
     parser = ap.ArgumentParser( description='Brutus script arguments' )
     parser.add_argument( '--dispatch', action='store_true',
             help='Run the script as a dispatcher, needs arguments' )
+    parser.add_argument( '--sweep', action='store_true',
+            help='Compute all gammas in one process, needs the same arguments as '
+            '--dispatch' )
     parser.add_argument('--name', action='store',
             help='Name of the experiment', required=True)
     parser.add_argument('--number_solutions', action='store', type=int, 
@@ -215,8 +556,42 @@ if __name__ == "__main__":
             help='Number of repetitions to simulate error')
     parser.add_argument('--repetitions_for_mi', action='store', type=int, 
             help='Number of repetitions for computing MI')
+    parser.add_argument('--tolerance_for_error', action='store', type=float, 
+            help='Sample the error until its confidence interval is within this')
+    parser.add_argument('--tolerance_for_mi', action='store', type=float, 
+            help='Sample MI until its confidence interval is within this')
+    parser.add_argument('--seed', action='store', type=int, 
+            help='Seed of the random streams of the experiment, random by default')
+    parser.add_argument('--scheduler', action='store', default='local',
+            choices=sorted( schedulers.keys() ), 
+            help='Scheduler to dispatch the jobs with' )
+    parser.add_argument('--resume', action='store_true', help='Dispatch only the '
+            'missing or failed jobs of an already dispatched experiment' )
+    parser.add_argument('--resume_pending', action='store_true', help='With '
+            '--resume, also dispatch the jobs still queued or running' )
+    parser.add_argument('--workers', action='store', type=int, 
+            help='Number of local worker processes for dispatching, defaults to '
+            'the number of cores')
+    parser.add_argument('--cprofile', action='store_true', help='Dump cProfile '
+        'stats of every job into the experiment folder')
     parser.add_argument('--finalize', action='store_true', help='Finalize several jobs results')
+    parser.add_argument('--migrate', action='store_true', help='Convert pickled '
+        'results into the current format')
+    parser.add_argument('--watch', action='store_true', help='With --finalize, '
+        'keep merging job results as they appear')
+    parser.add_argument('--watch_interval', action='store', type=float, default=10.0,
+        help='Seconds between checks for new job results with --watch')
     parser.add_argument('--plot', action='store_true', help='Plot results into file')
+    parser.add_argument('--plot_workers', action='store', type=int, 
+        help='Number of processes plotting the p_joint heatmaps, defaults to '
+        'the number of cores')
+    parser.add_argument('--p_joint_output', action='store', default='files',
+        choices=[ 'files', 'multipage', 'tiled' ], 
+        help='Heatmaps of p_joint per gamma, in one PDF or tiled in one figure')
+    parser.add_argument('--replot', action='store_true', help='Replot the '
+        'heatmaps of gammas whose p_joint has not changed too')
+    parser.add_argument('--kernel_cache_dir', action='store', 
+        help='Directory of the cached noise kernels, defaults to data/kernels')
     parser.add_argument('--gitcommit', action='store_true', help='Whether to commit finalized'
         ' or plotted result' )
 
@@ -230,6 +605,12 @@ if __name__ == "__main__":
     if not os.path.exists( figs_dir_name ):
         os.mkdir( figs_dir_name )
 
+    # Noise kernels are shared between experiments.
+    noise_models.kernel_cache_dir = args.kernel_cache_dir or os.path.join( 
+        dir_name, kernel_cache_folder_name )
+    if not os.path.exists( noise_models.kernel_cache_dir ):
+        os.mkdir( noise_models.kernel_cache_dir )
+
     dir_name = os.path.join( dir_name, args.name )
     if not os.path.exists( dir_name ):
         os.mkdir( dir_name )
@@ -237,13 +618,24 @@ if __name__ == "__main__":
     # Now perform the job.
     if args.dispatch:
         dispatch_jobs( dir_name, args )
+
+    elif args.sweep:
+        sweep_jobs( dir_name, args )
     
     elif args.onejob:
+        args.startup = profiling.startup_phase()
+        if args.jobnumber is None:
+            args.jobnumber = job_schedulers.array_jobnumber()
         process_onejob( dir_name, args )
 
     elif args.finalize:
         finalize_results( dir_name, args )
 
+    elif args.migrate:
+        migrate_results( dir_name, args )
+
     elif args.plot:
+        # matplotlib and LaTeX are loaded for plotting only.
+        import plot_functions
         plot_functions.plot_mutual_information( dir_name, figs_dir_name, args )
 
@@ -0,0 +1,364 @@
+import argparse as ap
+import os
+import sys
+import glob
+import json
+import math
+import pickle
+import numpy as np
+import scipy.sparse
+import scipy.stats
+from itertools import product
+
+from common_defs import *
+import noise_models
+import adaptive_sampling
+import engines
+
+"""
+Cross-engine validation: fast engines against the reference ones.
+
+USAGE:
+    python validate_engines.py [--cases C] [--seed S] [--archived]
+        [--engines NAME ...] [--output FILE]
+
+Runs every pair of engines of exact_pairs (fast engine, reference loop
+engine) side by side on --cases random small (number_solutions, gamma,
+noise model) cases, and with --archived also on the settings of the
+archived experiments data/mi_*, and reports the maximal absolute
+differences of p_joint, MI and the entropies. Differences above
+--tolerance fail the validation.
+
+The sampling engines of statistical_pairs are checked against the
+analytic ones: the difference of the estimates must be within
+--statistical_factor times the confidence half width the sampling engine
+reports (see adaptive_sampling), plus for MI the plug-in bias bound
+nonzeros( p_joint ) / ( 2 draws ln 2 ).
+
+The reference engines share the noise kernels (noise_models) and the 
+entropy reduction (entropies) with the fast ones, hence oracle_checks 
+check these against independent per-cell evaluations as the original 
+engines did them: the trunc-gauss kernel against scipy.stats.truncnorm, 
+and MI and entropies of p_joint against a p log p loop.
+
+Exits with status 1 if any case fails. --output writes all the cases as
+JSON.
+"""
+
+# Pairs (fast engine, reference engine) computing the same quantities.
+exact_pairs = [
+    ( 'mi_computing_1_vec', 'mi_computing_1' ),
+    ( 'mi_computing_3_vec', 'mi_computing_3' ),
+    ( 'mi_computing_4_vec', 'mi_computing_4' ),
+]
+
+# Pairs (sampling engine, analytic engine) estimating the same quantities.
+statistical_pairs = [
+    ( 'mi_computing_2', 'mi_computing_3' ),
+    ( 'error_computing_1', 'error_computing_2' ),
+]
+
+# Checks (checked, independent oracle) of the pieces the engines share.
+oracle_checks = [
+    ( 'noise_kernel', 'truncnorm_cells' ),
+    ( 'joint_entropies', 'plogp_loop' ),
+]
+
+# Largest number_solutions the slow engines and oracles are run at, by the
+#  validation and by benchmark.py.
+max_solutions = {
+    'mi_computing_1': 10,
+    'mi_computing_1_vec': 200,
+    'mi_computing_3': 40,
+    'mi_computing_4': 200,
+    'truncnorm_cells': 60,
+    'plogp_loop': 100,
+}
+
+# Experiments of data/ validated on with --archived.
+archived_experiments = 'mi_*'
+
+# Noise models of the random cases, {sigma}, {scale} and {width} being
+#  drawn per case.
+random_noise_models = [
+    'trunc-gauss_{sigma}',
+    'laplace_{scale}',
+    'uniform-window_{width}',
+    'one-peaked-debug_0',
+    'one-peaked-running-debug',
+    'two-independent',
+    'mixture_0.7_trunc-gauss_{sigma}_0.3_two-independent',
+]
+
+# Fields of the engine outputs compared.
+compared_fields = [ 'mutual_inf', 'p_joint', 'h_joint', 'h_single',
+    'mean_err', 'std_err' ]
+
+'''
+Returns a CustomObj with the fields of compared_fields the engine computes,
+and the sampling record for sampling engines.
+'''
+def run_engine( name, gamma, experiment ):
+    outputs = CustomObj()
+    sampling = CustomObj()
+    adaptive_sampling.record( sampling, 0, 0.0 )
+    arguments = {}
+
+    if name in engines.mi_computing_modules:
+        module = engines.mi_computing_module( name )
+        if getattr( module, 'records_sampling', False ):
+            arguments[ 'sampling' ] = sampling
+        result = module.compute_mutual_inf( gamma, experiment, **arguments )
+        # mi_computing_1 computes MI only.
+        if np.isscalar( result ):
+            outputs.mutual_inf = result
+        else:
+            outputs.mutual_inf, p_joint, outputs.h_joint, outputs.h_single = result
+            if scipy.sparse.issparse( p_joint ):
+                p_joint = p_joint.toarray()
+            outputs.p_joint = np.asarray( p_joint )
+    else:
+        module = engines.error_computing_module( name )
+        if getattr( module, 'records_sampling', False ):
+            arguments[ 'sampling' ] = sampling
+        outputs.mean_err, outputs.std_err = module.compute_error( gamma,
+            experiment, **arguments )
+
+    outputs.sampling = sampling
+    return outputs
+
+'''
+Returns the maximal absolute differences of the fields both outputs have.
+'''
+def differences( outputs, reference_outputs ):
+    return dict( ( field, float( np.max( np.abs( np.asarray(
+        getattr( outputs, field ), dtype = float ) - getattr( reference_outputs,
+        field ) ) ) ) ) for field in compared_fields
+        if hasattr( outputs, field ) and hasattr( reference_outputs, field ) )
+
+def validation_experiment( number_solutions, noise_model, args ):
+    experiment = CustomObj()
+    experiment.number_solutions = number_solutions
+    experiment.noise_model = noise_model
+    experiment.repetitions_for_mi = args.repetitions
+    experiment.repetitions_for_error = args.repetitions
+    experiment.seed = args.seed
+    return experiment
+
+'''
+Returns the list of cases (source, number_solutions, gamma, noise model):
+random ones, drawn with the seed, and with archived those of the archived
+experiments, at most archived_gammas gammas of each.
+'''
+def validation_cases( args, dir_name ):
+    rng = np.random.RandomState( args.seed )
+    cases = []
+    for case in range( args.cases ):
+        number_solutions = rng.randint( 3, args.max_solutions + 1 )
+        gamma = rng.randint( 0, number_solutions )
+        noise_model = random_noise_models[ rng.randint(
+            len( random_noise_models ) ) ].format(
+            sigma = rng.choice( [ 0.5, 1, 2, 5 ] ),
+            scale = rng.choice( [ 0.5, 2 ] ), width = rng.randint( 0, 4 ) )
+        cases.append( ( 'random', number_solutions, gamma, noise_model ) )
+
+    if args.archived:
+        setting_filenames = glob.glob( os.path.join( dir_name,
+            archived_experiments, '*_' + experiment_setting_filename + os.extsep
+            + pickle_suffix ) )
+        for setting_filename in sorted( setting_filenames ):
+            with open( setting_filename, 'rb' ) as input:
+                experiment = pickle.load( input )
+            job_gammas = np.asarray( experiment.job_gammas )
+            picked = np.unique( np.linspace( 0, len( job_gammas ) - 1,
+                args.archived_gammas ).astype( int ) )
+            cases += [ ( experiment.name, int( experiment.number_solutions ),
+                int( gamma ), experiment.noise_model )
+                for gamma in job_gammas[ picked ] ]
+
+    return cases
+
+def validate_exact( engine, reference, experiment, gamma, args ):
+    differences_ = differences( run_engine( engine, gamma, experiment ),
+        run_engine( reference, gamma, experiment ) )
+    passed = all( difference <= args.tolerance
+        for difference in differences_.values() )
+    return differences_, passed
+
+'''
+Checks the estimate of a sampling engine against the analytic reference,
+see the module docstring.
+'''
+def validate_statistical( engine, reference, experiment, gamma, args ):
+    outputs = run_engine( engine, gamma, experiment )
+    reference_outputs = run_engine( reference, gamma, experiment )
+    differences_ = differences( outputs, reference_outputs )
+
+    if hasattr( outputs, 'mutual_inf' ):
+        estimate_difference = differences_[ 'mutual_inf' ]
+        bias_bound = np.count_nonzero( outputs.p_joint ) / ( 2.0
+            * outputs.sampling.draws * np.log( 2 ) )
+    else:
+        estimate_difference = differences_[ 'mean_err' ]
+        bias_bound = 0.0
+
+    allowed_difference = ( args.statistical_factor
+        * outputs.sampling.ci_halfwidth + bias_bound )
+    differences_[ 'allowed' ] = float( allowed_difference )
+    return differences_, estimate_difference <= allowed_difference
+
+'''
+Returns p( x | mu ) of trunc-gauss_<sigma> evaluated cell by cell with
+scipy.stats.truncnorm, as the original noise_models did.
+'''
+def truncnorm_kernel( sigma, number_solutions ):
+    kernel = np.zeros( ( number_solutions, number_solutions ) )
+    left, right = 0, number_solutions - 1
+    for ( x, mu ) in product( xrange( number_solutions ), repeat = 2 ):
+        left_truncated = ( left - mu ) / sigma
+        right_truncated = ( right - mu ) / sigma
+        kernel[ x, mu ] = ( scipy.stats.truncnorm.cdf( x + 0.5, left_truncated,
+            right_truncated, loc = mu, scale = sigma )
+            - scipy.stats.truncnorm.cdf( x - 0.5, left_truncated,
+            right_truncated, loc = mu, scale = sigma ) )
+    return kernel
+
+'''
+Checks the kernel of trunc-gauss noise models against truncnorm_kernel.
+Returns None for other noise models, which the original did not have.
+'''
+def validate_kernel( checked, oracle, experiment, gamma, args ):
+    tokens = experiment.noise_model.split( '_' )
+    if tokens[0] != noise_models.trunc_gauss_nm or len( tokens ) != 2:
+        return None
+
+    kernel, prior = noise_models.noise_kernel( experiment.noise_model,
+        experiment.number_solutions )
+    differences_ = { 'kernel': float( np.max( np.abs( np.asarray( kernel )
+        - truncnorm_kernel( float( tokens[1] ),
+        experiment.number_solutions ) ) ) ) }
+    return differences_, differences_[ 'kernel' ] <= args.tolerance
+
+'''
+Returns MI, joint entropy and single entropy of the symmetric p_joint 
+summed cell by cell, as the original engines did.
+'''
+def plogp_entropies( p_joint ):
+    p_single = np.sum( p_joint, axis = 0 )
+    mutual_inf = h_joint = h_single = 0.0
+    for ( i, j ) in product( xrange( p_joint.shape[0] ), repeat = 2 ):
+        if np.allclose( p_joint[ i, j ], 0 ):
+            continue
+        mutual_inf += p_joint[ i, j ] * math.log(
+            p_joint[ i, j ] / ( p_single[i] * p_single[j] ), 2 )
+        h_joint += - p_joint[ i, j ] * math.log( p_joint[ i, j ], 2 )
+        if not np.allclose( p_single[i], 0 ):
+            h_single += - p_joint[ i, j ] * math.log( p_single[i], 2 )
+    return mutual_inf, h_joint, h_single
+
+'''
+Checks MI and entropies of mi_computing_3_vec, reduced by entropies, 
+against plogp_entropies of its p_joint.
+'''
+def validate_entropies( checked, oracle, experiment, gamma, args ):
+    outputs = run_engine( 'mi_computing_3_vec', gamma, experiment )
+    oracle_outputs = CustomObj()
+    oracle_outputs.mutual_inf, oracle_outputs.h_joint, \
+        oracle_outputs.h_single = plogp_entropies( outputs.p_joint )
+    differences_ = differences( outputs, oracle_outputs )
+    return differences_, all( difference <= args.tolerance
+        for difference in differences_.values() )
+
+def format_differences( differences_ ):
+    return ' '.join( '{field}={difference:.2e}'.format( field = field,
+        difference = difference )
+        for field, difference in sorted( differences_.items() ) )
+
+def report( case ):
+    print( '{verdict:4} {source:8} N={number_solutions:<4} gamma={gamma:<4} '
+        '{noise_model:52} {engine:18} vs {reference:18} {listed}'.format(
+        verdict = 'ok' if case[ 'passed' ] else 'FAIL',
+        listed = format_differences( case[ 'differences' ] ), **case ) )
+
+if __name__ == "__main__":
+
+    parser = ap.ArgumentParser( description='Validation of the fast engines '
+        'against the reference ones' )
+    parser.add_argument('--cases', action='store', type=int, default=20,
+        help='Number of random cases')
+    parser.add_argument('--max_solutions', action='store', type=int, default=16,
+        help='Largest number_solutions of the random cases')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+        help='Seed of the random cases and of the sampling engines')
+    parser.add_argument('--archived', action='store_true',
+        help='Validate on the settings of the archived experiments too')
+    parser.add_argument('--archived_gammas', action='store', type=int, default=3,
+        help='Number of gammas validated per archived experiment')
+    parser.add_argument('--engines', action='store', nargs='+',
+        help='Validate only these fast or sampling engines')
+    parser.add_argument('--repetitions', action='store', type=int, default=10**6,
+        help='Draws of the sampling engines')
+    parser.add_argument('--tolerance', action='store', type=float, default=1e-9,
+        help='Largest absolute difference of exact engines')
+    parser.add_argument('--statistical_factor', action='store', type=float,
+        default=2.0, help='Multiple of the confidence half width the estimates '
+        'of sampling engines may differ by')
+    parser.add_argument('--output', action='store', help='JSON file for the cases')
+
+    args = parser.parse_args()
+
+    dir_name = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+        experiments_folder_name )
+
+    validators = [ ( engine, reference, validate_exact )
+        for engine, reference in exact_pairs ]
+    validators += [ ( engine, reference, validate_statistical )
+        for engine, reference in statistical_pairs ]
+    oracle_validators = dict( truncnorm_cells = validate_kernel,
+        plogp_loop = validate_entropies )
+    validators += [ ( checked, oracle, oracle_validators[ oracle ] )
+        for checked, oracle in oracle_checks ]
+
+    results = []
+    for source, number_solutions, gamma, noise_model in validation_cases( args,
+            dir_name ):
+        experiment = validation_experiment( number_solutions, noise_model, args )
+        for engine, reference, validate in validators:
+            if args.engines and engine not in args.engines:
+                continue
+            if number_solutions > min( max_solutions.get( engine, number_solutions ),
+                    max_solutions.get( reference, number_solutions ) ):
+                continue
+            validation = validate( engine, reference, experiment, gamma, args )
+            # Not applicable to the case.
+            if validation is None:
+                continue
+            differences_, passed = validation
+            results.append( dict( source = source,
+                number_solutions = number_solutions, gamma = gamma,
+                noise_model = noise_model, engine = engine, reference = reference,
+                differences = differences_, passed = bool( passed ) ) )
+            report( results[-1] )
+
+    print( '\nMaximal absolute differences:' )
+    for engine, reference, validate in validators:
+        engine_results = [ result for result in results
+            if result[ 'engine' ] == engine ]
+        if not engine_results:
+            continue
+        fields = sorted( set( field for result in engine_results
+            for field in result[ 'differences' ] if field != 'allowed' ) )
+        print( '{engine:18} vs {reference:18} {listed}'.format( engine = engine,
+            reference = reference, listed = format_differences( dict(
+            ( field, max( result[ 'differences' ].get( field, 0.0 )
+            for result in engine_results ) ) for field in fields ) ) ) )
+
+    if args.output:
+        with open( args.output, 'w' ) as output:
+            json.dump( results, output, indent = 1, sort_keys = True )
+
+    failures = [ result for result in results if not result[ 'passed' ] ]
+    print( '{cases} cases, {failures} failed'.format( cases = len( results ),
+        failures = len( failures ) ) )
+    if failures:
+        sys.exit( 1 )